@@ -0,0 +1,206 @@
+import numpy as np
+from datetime import datetime, date
+from typing import Dict, Any, Optional
+import logging
+from sqlalchemy import select
+from models import Session, User, Message, ActivityPattern
+from seasons import current_season
+
+logger = logging.getLogger('LeaderboardBot')
+
+DAY_NAMES = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+HEATMAP_LEVELS = ' ░▒▓█'
+
+def weekday_occurrences(start: date, end: date) -> np.ndarray:
+    """Count how many times each weekday (0=Monday) occurs between two dates, inclusive."""
+    occurrences = np.zeros(7, dtype=np.int64)
+    total_days = (end - start).days + 1
+    if total_days <= 0:
+        return occurrences
+    full_weeks, remainder = divmod(total_days, 7)
+    occurrences += full_weeks
+    occurrences[(start.weekday() + np.arange(remainder)) % 7] += 1
+    return occurrences
+
+class ActivityMatrix:
+    """Per-user 7x24 message counts held in one NumPy array.
+
+    ``counts[row]`` is the day-of-week/hour histogram of the user whose database
+    id maps to ``row`` in ``index``. The matrix mirrors the current season's rows
+    in ``activity_patterns`` so analytics never have to scan ``messages``.
+    """
+    def __init__(self, capacity: int = 64):
+        self.index: Dict[int, int] = {}
+        self.counts = np.zeros((capacity, 7, 24), dtype=np.int64)
+        self.first_active = np.full(capacity, np.datetime64('NaT'), dtype='datetime64[D]')
+
+    def clear(self):
+        """Drop all counts, e.g. after the statistics have been reset."""
+        self.index.clear()
+        self.counts[:] = 0
+        self.first_active[:] = np.datetime64('NaT')
+
+    def _row(self, user_id: int) -> int:
+        """Return the row for a user, growing the arrays when they are full."""
+        row = self.index.get(user_id)
+        if row is not None:
+            return row
+
+        row = len(self.index)
+        if row >= len(self.counts):
+            capacity = len(self.counts) * 2
+            counts = np.zeros((capacity, 7, 24), dtype=np.int64)
+            counts[:row] = self.counts[:row]
+            first_active = np.full(capacity, np.datetime64('NaT'), dtype='datetime64[D]')
+            first_active[:row] = self.first_active[:row]
+            self.counts, self.first_active = counts, first_active
+        self.index[user_id] = row
+        return row
+
+    def record(self, user_id: int, timestamp: datetime, count: int = 1):
+        """Add a message to a user's histogram."""
+        row = self._row(user_id)
+        self.counts[row, timestamp.weekday(), timestamp.hour] += count
+        day = np.datetime64(timestamp.date(), 'D')
+        if np.isnat(self.first_active[row]) or day < self.first_active[row]:
+            self.first_active[row] = day
+
+    def load(self, session: Session):
+        """Load the matrix from ``activity_patterns``, rebuilding it from messages if it is empty."""
+        self.clear()
+
+        season_id = current_season(session).id
+        rows = session.query(
+            ActivityPattern.user_id, ActivityPattern.day_of_week,
+            ActivityPattern.hour, ActivityPattern.message_count
+        ).join(User).filter(User.season_id == season_id).all()
+        if not rows:
+            if session.query(Message.id).join(User).filter(User.season_id == season_id).first():
+                self.rebuild_from_messages(session)
+            return
+
+        for user_id in {row[0] for row in rows}:
+            self._row(user_id)
+        data = np.array(rows, dtype=np.int64)
+        user_rows = np.array([self.index[user_id] for user_id in data[:, 0]], dtype=np.int64)
+        np.add.at(self.counts, (user_rows, data[:, 1], data[:, 2]), data[:, 3])
+
+        for user_id, first_active_date in session.query(User.id, User.first_active_date).filter(
+                User.season_id == season_id):
+            if user_id in self.index and first_active_date:
+                self.first_active[self.index[user_id]] = np.datetime64(first_active_date.date(), 'D')
+
+        logger.info(f"Loaded activity patterns for {len(self.index)} users")
+
+    def rebuild_from_messages(self, session: Session):
+        """Recompute the current season's histograms from stored messages and persist them."""
+        logger.info("Rebuilding activity patterns from message history...")
+        self.clear()
+        season_users = select(User.id).where(User.season_id == current_season(session).id)
+        messages = session.query(Message.user_id, Message.timestamp).filter(Message.user_id.in_(season_users))
+        for user_id, timestamp in messages.yield_per(10000):
+            if timestamp is not None:
+                self.record(user_id, timestamp)
+
+        session.query(ActivityPattern).filter(
+            ActivityPattern.user_id.in_(season_users)
+        ).delete(synchronize_session=False)
+        patterns = []
+        for user_id, row in self.index.items():
+            for day_of_week, hour in zip(*np.nonzero(self.counts[row])):
+                patterns.append({
+                    'user_id': user_id,
+                    'day_of_week': int(day_of_week),
+                    'hour': int(hour),
+                    'message_count': int(self.counts[row, day_of_week, hour])
+                })
+        if patterns:
+            session.execute(ActivityPattern.__table__.insert(), patterns)
+        session.commit()
+        logger.info(f"Rebuilt activity patterns for {len(self.index)} users")
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """The state to persist, trimmed to the rows in use."""
+        count = len(self.index)
+        user_ids = np.zeros(count, dtype=np.int64)
+        for user_id, row in self.index.items():
+            user_ids[row] = user_id
+        return {
+            'user_ids': user_ids,
+            'counts': self.counts[:count],
+            'first_active': self.first_active[:count].astype(np.int64),
+        }
+
+    def restore(self, arrays: Dict[str, np.ndarray]):
+        """Replace the matrix with previously persisted arrays."""
+        count = len(arrays['user_ids'])
+        capacity = max(64, 1 << max(count - 1, 0).bit_length())
+        self.counts = np.zeros((capacity, 7, 24), dtype=np.int64)
+        self.counts[:count] = arrays['counts']
+        self.first_active = np.full(capacity, np.datetime64('NaT'), dtype='datetime64[D]')
+        self.first_active[:count] = np.asarray(arrays['first_active']).astype('datetime64[D]')
+        self.index = {int(user_id): row for row, user_id in enumerate(arrays['user_ids'])}
+
+    def user_counts(self, user_id: int) -> Optional[np.ndarray]:
+        """Return a user's 7x24 histogram, or None if they have no recorded activity."""
+        row = self.index.get(user_id)
+        return None if row is None else self.counts[row]
+
+    def user_first_active(self, user_id: int) -> Optional[date]:
+        """Return the first day a user was active."""
+        row = self.index.get(user_id)
+        if row is None or np.isnat(self.first_active[row]):
+            return None
+        return self.first_active[row].astype(date)
+
+    def server_counts(self) -> np.ndarray:
+        """Return the 7x24 histogram summed over every user."""
+        return self.counts[:len(self.index)].sum(axis=0)
+
+    def server_first_active(self) -> Optional[date]:
+        """Return the first day anyone on the server was active."""
+        known = self.first_active[:len(self.index)]
+        known = known[~np.isnat(known)]
+        return known.min().astype(date) if len(known) else None
+
+def summarize_activity(counts: np.ndarray, first_active: Optional[date],
+                       today: Optional[date] = None) -> Dict[str, Any]:
+    """Compute peak hours and true per-day averages from a 7x24 histogram."""
+    today = today or datetime.utcnow().date()
+    by_day = counts.sum(axis=1)
+    by_hour = counts.sum(axis=0)
+
+    days_elapsed = weekday_occurrences(first_active or today, today)
+    daily_averages = np.divide(by_day, days_elapsed, out=np.zeros(7),
+                               where=days_elapsed > 0)
+
+    weekdays, weekend_days = days_elapsed[:5].sum(), days_elapsed[5:].sum()
+    peak_hours = [int(hour) for hour in np.argsort(by_hour, kind='stable')[::-1][:3]
+                  if by_hour[hour] > 0]
+
+    return {
+        'total': int(counts.sum()),
+        'peak_hours': peak_hours,
+        'hour_counts': by_hour,
+        'daily_averages': daily_averages,
+        'busiest_day': int(np.argmax(daily_averages)),
+        'weekday_average': by_day[:5].sum() / weekdays if weekdays else 0.0,
+        'weekend_average': by_day[5:].sum() / weekend_days if weekend_days else 0.0,
+        'days_tracked': int(days_elapsed.sum()),
+    }
+
+def render_heatmap(counts: np.ndarray) -> str:
+    """Render a 7x24 histogram as a block-character heatmap (hours in UTC)."""
+    peak = counts.max()
+    if peak > 0:
+        levels = np.ceil(counts / peak * (len(HEATMAP_LEVELS) - 1)).astype(int)
+    else:
+        levels = np.zeros_like(counts)
+
+    lines = ["    0     6     12    18   "]
+    for day, row in zip(DAY_NAMES, levels):
+        lines.append(f"{day} " + "".join(HEATMAP_LEVELS[level] for level in row))
+    return "\n".join(lines)
+
+# Shared in-memory matrix used by the bot
+activity_matrix = ActivityMatrix()
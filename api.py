@@ -0,0 +1,264 @@
+import logging
+import math
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from aiohttp import web
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+from models import Session, User, Message, UserBadge
+from scheduler import scheduler
+from standings import standings, LeaderboardEntry, RECENT_HOURS
+from seasons import current_season, find_season
+from utils import load_leaderboard_users
+from config import API_HOST, API_PORT, API_RATE_LIMIT, API_RATE_PERIOD, API_PAGE_SIZE
+
+logger = logging.getLogger('LeaderboardBot')
+
+MAX_PAGE_SIZE = 100
+MAX_WINDOW_DAYS = 90
+
+class ClientRateLimiter:
+    """Sliding-window request limit per client address."""
+    def __init__(self, limit: int = API_RATE_LIMIT, period: float = API_RATE_PERIOD):
+        self.limit = limit
+        self.period = period
+        self._requests: Dict[str, Deque[float]] = defaultdict(deque)
+        self._pruned_at = time.monotonic()
+
+    def check(self, client: str) -> float:
+        """Record a request; returns 0 if allowed, else seconds until the client may retry."""
+        now = time.monotonic()
+        if now - self._pruned_at > self.period:
+            self.prune()
+        requests = self._requests[client]
+        while requests and requests[0] <= now - self.period:
+            requests.popleft()
+        if len(requests) >= self.limit:
+            return requests[0] + self.period - now
+        requests.append(now)
+        return 0.0
+
+    def prune(self):
+        """Forget clients with no requests in the current window."""
+        now = self._pruned_at = time.monotonic()
+        for client in [client for client, requests in self._requests.items()
+                       if not requests or requests[-1] <= now - self.period]:
+            del self._requests[client]
+
+def data_etag() -> str:
+    """ETag for every response, from the standings version and the hour.
+
+    Any committed change bumps the standings version, and 24-hour counts roll over
+    hourly, so an unchanged tag means unchanged data.
+    """
+    return f'"{standings.season_id}.{standings.version}.{int(time.time() // 3600)}"'
+
+def _not_modified(request: web.Request, etag: str) -> bool:
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    tags = {tag.strip().removeprefix('W/') for tag in header.split(',')}
+    return '*' in tags or etag in tags
+
+def _etag_response(request: web.Request, etag: str, data: Dict[str, Any]) -> web.Response:
+    """JSON response tagged with ``etag``, or 304 if the client already holds that tag."""
+    if _not_modified(request, etag):
+        raise web.HTTPNotModified(headers={'ETag': etag})
+    return web.json_response(data, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+def _known_total(request: web.Request, key: tuple, etag: str) -> Optional[int]:
+    """Item count of a list resource last served under ``etag``, if any."""
+    cached = request.app['totals'].get(key)
+    return cached[1] if cached and cached[0] == etag else None
+
+def _remember_total(request: web.Request, key: tuple, etag: str, total: int):
+    request.app['totals'][key] = (etag, total)
+
+def _check_not_modified(request: web.Request, etag: str, total: Optional[int]):
+    """Answer 304 before any work is queued, once the request is known to be valid.
+
+    ``total`` is the list's item count, needed to validate the page; when it is
+    unknown the handler loads the data and ``_etag_response`` decides instead.
+    """
+    if total is None or not _not_modified(request, etag):
+        return
+    _page_bounds(request, total)
+    raise web.HTTPNotModified(headers={'ETag': etag})
+
+def _int_param(request: web.Request, name: str, default: int, low: int, high: int) -> int:
+    value = request.query.get(name)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name} must be an integer")
+    if not low <= number <= high:
+        raise web.HTTPBadRequest(text=f"{name} must be between {low} and {high}")
+    return number
+
+def _page_bounds(request: web.Request, total: int) -> Tuple[int, int, int]:
+    """Validated (page, per_page, pages) for a list of ``total`` items."""
+    per_page = _int_param(request, 'per_page', API_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+    pages = max(1, math.ceil(total / per_page))
+    page = _int_param(request, 'page', 1, 1, pages)
+    return page, per_page, pages
+
+def _paginate(request: web.Request, items: List) -> Dict[str, Any]:
+    page, per_page, pages = _page_bounds(request, len(items))
+    start = (page - 1) * per_page
+    return {'page': page, 'per_page': per_page, 'pages': pages, 'total': len(items),
+            'start': start, 'items': items[start:start + per_page]}
+
+def _entry_json(rank: int, entry: LeaderboardEntry) -> Dict[str, Any]:
+    # Snowflakes are strings, since JSON numbers lose precision past 2**53
+    return {
+        'rank': rank, 'discord_id': str(entry.discord_id), 'total_messages': entry.total_messages,
+        'recent_messages': entry.recent_messages, 'streak': entry.streak, 'best_streak': entry.best_streak,
+        'replies_received': entry.replies_received, 'reactions_received': entry.reactions_received,
+        'score': entry.score, 'badges': entry.badge_emojis,
+    }
+
+def load_user_stats(discord_id: int) -> Optional[Dict[str, Any]]:
+    """A user's current-season stats and badges, or None if they have none."""
+    session = Session()
+    try:
+        user = (
+            session.query(User)
+            .options(selectinload(User.badges).selectinload(UserBadge.badge))
+            .filter_by(season_id=current_season(session).id, discord_id=discord_id)
+            .first()
+        )
+        if not user:
+            return None
+        return {
+            'discord_id': str(user.discord_id),
+            'total_messages': user.total_messages or 0,
+            'streak': user.streak or 0,
+            'best_streak': user.best_streak or 0,
+            'first_active_date': user.first_active_date.isoformat() if user.first_active_date else None,
+            'last_active_date': user.last_active_date.isoformat() if user.last_active_date else None,
+            'night_owl_messages': user.night_owl_messages or 0,
+            'early_bird_messages': user.early_bird_messages or 0,
+            'weekend_messages': user.weekend_messages or 0,
+            'weekday_messages': user.weekday_messages or 0,
+            'replies_received': user.replies_received or 0,
+            'reactions_received': user.reactions_received or 0,
+            'score': user.score or 0.0,
+            'badges': [{'name': user_badge.badge.name, 'emoji': user_badge.badge.emoji,
+                        'description': user_badge.badge.description,
+                        'earned_date': user_badge.earned_date.isoformat() if user_badge.earned_date else None}
+                       for user_badge in sorted(user.badges, key=lambda user_badge: user_badge.badge_id)],
+        }
+    finally:
+        session.close()
+
+def load_window_ranking(hours: int) -> List[tuple]:
+    """(discord_id, messages) in the current season over the last ``hours`` hours, most active first."""
+    session = Session()
+    try:
+        since = datetime.utcnow() - timedelta(hours=hours)
+        count = func.count(Message.id)
+        return [tuple(row) for row in (
+            session.query(User.discord_id, count)
+            .join(Message, Message.user_id == User.id)
+            .filter(User.season_id == current_season(session).id, Message.timestamp >= since)
+            .group_by(User.id, User.discord_id)
+            .order_by(count.desc(), User.total_messages.desc(), User.id)
+        )]
+    finally:
+        session.close()
+
+def window_ranking(hours: Optional[int], days: Optional[int]) -> List[tuple]:
+    """Windows up to a day come from the in-memory hourly buckets, longer ones from the messages."""
+    if days is None and standings.ready:
+        return standings.window_ranking(hours)
+    return load_window_ranking(days * 24 if days is not None else hours)
+
+@web.middleware
+async def rate_limit_middleware(request: web.Request, handler):
+    retry_after = request.app['rate_limiter'].check(request.remote or 'unknown')
+    if retry_after > 0:
+        return web.json_response({'error': 'rate limit exceeded'}, status=429,
+                                 headers={'Retry-After': str(math.ceil(retry_after))})
+    return await handler(request)
+
+async def get_leaderboard(request: web.Request) -> web.Response:
+    """Leaderboard pages; ``?season=<number>`` for a past season."""
+    season_id = None
+    if 'season' in request.query:
+        season = find_season(_int_param(request, 'season', 0, 1, 1_000_000))
+        if season is None:
+            raise web.HTTPNotFound(text="no such season")
+        season_id = season.id
+    # Taken before reading, so a write that lands meanwhile changes the next tag
+    etag = data_etag()
+    key = ('leaderboard', season_id)
+    total = _known_total(request, key, etag)
+    if standings.ready and season_id in (None, standings.season_id):
+        total = standings.leaderboard_size()
+    _check_not_modified(request, etag, total)
+
+    entries = await scheduler.run_interactive(load_leaderboard_users, season_id)
+    _remember_total(request, key, etag, len(entries))
+    page = _paginate(request, entries)
+    items = page.pop('items')
+    start = page.pop('start')
+    return _etag_response(request, etag, {**page, 'entries': [
+        _entry_json(rank, entry) for rank, entry in enumerate(items, start=start + 1)
+    ]})
+
+async def get_user(request: web.Request) -> web.Response:
+    """One user's current-season stats."""
+    try:
+        discord_id = int(request.match_info['discord_id'])
+    except ValueError:
+        raise web.HTTPBadRequest(text="discord_id must be an integer")
+    etag = data_etag()
+    if standings.ready and standings.has_user(discord_id) and _not_modified(request, etag):
+        raise web.HTTPNotModified(headers={'ETag': etag})
+
+    stats = await scheduler.run_interactive(load_user_stats, discord_id)
+    if stats is None:
+        raise web.HTTPNotFound(text="no activity recorded for this user")
+    return _etag_response(request, etag, stats)
+
+async def get_rankings(request: web.Request) -> web.Response:
+    """Most active users over a recent window: ``?hours=1..24`` (default 24) or ``?days=1..90``."""
+    days = _int_param(request, 'days', 0, 1, MAX_WINDOW_DAYS) if 'days' in request.query else None
+    hours = _int_param(request, 'hours', RECENT_HOURS, 1, RECENT_HOURS)
+    etag = data_etag()
+    key = ('rankings', hours, days)
+    _check_not_modified(request, etag, _known_total(request, key, etag))
+
+    ranking = await scheduler.run_interactive(window_ranking, hours, days)
+    _remember_total(request, key, etag, len(ranking))
+    page = _paginate(request, ranking)
+    items = page.pop('items')
+    start = page.pop('start')
+    window = {'days': days} if days is not None else {'hours': hours}
+    return _etag_response(request, etag, {**page, 'window': window, 'entries': [
+        {'rank': rank, 'discord_id': str(discord_id), 'messages': messages}
+        for rank, (discord_id, messages) in enumerate(items, start=start + 1)
+    ]})
+
+def create_app(rate_limit: int = API_RATE_LIMIT, rate_period: float = API_RATE_PERIOD) -> web.Application:
+    """Build the read-only JSON API."""
+    app = web.Application(middlewares=[rate_limit_middleware])
+    app['rate_limiter'] = ClientRateLimiter(rate_limit, rate_period)
+    # (resource, params) -> (etag, item count), to validate pages on a 304 without loading the list
+    app['totals'] = {}
+    app.router.add_get('/api/leaderboard', get_leaderboard)
+    app.router.add_get('/api/users/{discord_id}', get_user)
+    app.router.add_get('/api/rankings', get_rankings)
+    return app
+
+async def start_api(host: str = API_HOST, port: int = API_PORT) -> web.AppRunner:
+    """Serve the API on the running event loop; returns the runner to clean up on exit."""
+    runner = web.AppRunner(create_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"JSON API listening on http://{host}:{port}")
+    return runner
@@ -4,100 +4,139 @@ from discord.ext.commands import Context
 import logging
 from datetime import datetime, timedelta, UTC
 import asyncio
-from models import Session, User, Message, ActivityPattern, Badge, UserBadge, Base, engine
+from typing import Any, Callable, Optional, Union
+from sqlalchemy.orm import selectinload
+from models import engine, Session, User, UserBadge
 from utils import (
-    setup_logging, rate_limit, create_backup, update_user_stats,
-    check_and_award_badges, create_leaderboard_embed, create_user_stats_embed
+    setup_logging, rate_limit, create_backup, store_message, backfill_batch, load_channel_cursor,
+    delete_messages, delete_channel_messages,
+    load_leaderboard_users, create_leaderboard_embed, create_user_stats_embed,
+    create_activity_embed
 )
+from activity import activity_matrix, summarize_activity
+from scheduler import scheduler, BACKGROUND
+from engagement import engagement_tracker, recompute_scores
+from standings import standings
+from snapshot import load_state, write_snapshot
+from writes import stored_channel_ids
+from channels import tracked_channels, ADDED, REMOVED
+from outbound import outbound
+from api import start_api
+from seasons import current_season, find_season, start_new_season, seasons_to_compact, compact_season
 from config import (
-    TOKEN, LEADERBOARD_CHANNEL_ID, COMMAND_CHANNELS, TRACKED_CHANNEL_IDS,
+    TOKEN, LEADERBOARD_CHANNEL_ID, COMMAND_CHANNELS,
     ADMIN_IDS, COMMAND_RATE_LIMIT, LEADERBOARD_UPDATE_INTERVAL,
-    MESSAGE_FETCH_INTERVAL, BACKUP_INTERVAL
+    MESSAGE_FETCH_INTERVAL, BACKUP_INTERVAL, BACKFILL_BATCH_SIZE, ENGAGEMENT_FLUSH_INTERVAL,
+    SNAPSHOT_INTERVAL, API_ENABLED
 )
 
 # Initialize logging
 setup_logging()
 logger = logging.getLogger('LeaderboardBot')
-logger.setLevel(logging.DEBUG)  # Set to debug level for more detailed logs
 
 # Initialize bot with intents
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 intents.reactions = True
-bot = commands.Bot(command_prefix='!', intents=intents)
+# Discord's rate limit headers are fed back into the outbound queue's budgets
+bot = commands.Bot(command_prefix='!', intents=intents, http_trace=outbound.trace_config())
 
 # Global variables
 message_pages = {}  # Track pages per message ID
+leaderboard_seasons = {}  # Past season shown by each leaderboard message ID
 last_leaderboard_message = None
+backfills = {}  # Running history backfill task per channel ID
+api_runner = None  # JSON API server, when enabled
 
-async def fetch_message_history():
-    """Fetch message history from all tracked channels."""
+def message_record(message: discord.Message) -> tuple:
+    """Build the record the ingest path stores for a message, including what it replies to."""
+    reply_to_id = None
+    if message.type == discord.MessageType.reply and message.reference:
+        reply_to_id = message.reference.message_id
+    return (message.id, message.author.id, message.channel.id, message.created_at, reply_to_id)
+
+async def backfill_channel(channel) -> tuple:
+    """Store a channel's messages posted since its last backfill, oldest first.
+    
+    Each batch advances the channel's cursor once stored, so a restart or a
+    channel that is tracked again only reads what it has not seen.
+    """
+    total_messages = 0
+    new_messages = 0
+    try:
+        cursor = await scheduler.submit(load_channel_cursor, channel.id, lane=BACKGROUND)
+        logger.info(f"Fetching messages from {channel.name} ({channel.id})"
+                    + (f" after {cursor}" if cursor else ""))
+        batch = []
+        last_seen = None
+        after = discord.Object(id=cursor) if cursor else None
+        async for message in channel.history(limit=None, after=after, oldest_first=True):
+            last_seen = message.id
+            if message.author.bot:
+                continue
+            
+            batch.append(message_record(message))
+            if len(batch) >= BACKFILL_BATCH_SIZE:
+                new_messages += await scheduler.run_sliced(backfill_batch(channel.id, batch, last_seen),
+                                                           name=f'backfill {channel.name}')
+                total_messages += len(batch)
+                batch = []
+                logger.info(f"Processed {total_messages} messages from {channel.name} ({new_messages} new)...",
+                            extra={'sample_every': 10})
+        
+        # Also records trailing bot messages as read
+        if last_seen is not None:
+            new_messages += await scheduler.run_sliced(backfill_batch(channel.id, batch, last_seen),
+                                                       name=f'backfill {channel.name}')
+            total_messages += len(batch)
+        
+        logger.info(f"Completed fetching from {channel.name}")
+    except discord.Forbidden:
+        logger.warning(f"No access to channel: {channel.name}")
+    except Exception as e:
+        logger.error(f"Error fetching from {channel.name}: {str(e)}")
+    return total_messages, new_messages
+
+def start_backfill(channel) -> asyncio.Task:
+    """Backfill a channel in the background, or return the backfill already running for it."""
+    task = backfills.get(channel.id)
+    if task is None or task.done():
+        task = bot.loop.create_task(backfill_channel(channel))
+        backfills[channel.id] = task
+    return task
+
+async def cancel_backfills(channel_ids: list):
+    """Stop backfilling channels and wait until none of their batches are still being stored."""
+    for channel_id in channel_ids:
+        task = backfills.pop(channel_id, None)
+        if task and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+async def fetch_message_history(progress: Optional[Callable[[int, int, int], Any]] = None):
+    """Fetch new message history from all tracked channels.
+    
+    ``progress`` is called with (channels done, messages processed, new messages)
+    after each channel.
+    """
     logger.info("Starting message history fetch...")
     total_messages = 0
     new_messages = 0
     
-    for guild in bot.guilds:
-        for channel_id in TRACKED_CHANNEL_IDS:
-            channel = bot.get_channel(channel_id)
-            if not channel:
-                logger.warning(f"Could not find channel with ID: {channel_id}")
-                continue
-                
-            try:
-                logger.info(f"Fetching messages from {channel.name} ({channel.id})")
-                async for message in channel.history(limit=None):
-                    if message.author.bot:
-                        continue
-                        
-                    try:
-                        session = Session()
-                        
-                        # Check if message already exists
-                        existing_message = session.query(Message).filter_by(
-                            discord_message_id=str(message.id)
-                        ).first()
-                        
-                        if existing_message:
-                            session.close()
-                            total_messages += 1
-                            continue
-                        
-                        # Update user stats
-                        user = update_user_stats(session, str(message.author.id), message.created_at)
-                        
-                        # Store message
-                        db_message = Message(
-                            discord_message_id=str(message.id),
-                            user_id=user.id,
-                            channel_id=str(message.channel.id),
-                            timestamp=message.created_at
-                        )
-                        session.add(db_message)
-                        
-                        # Check and award badges
-                        check_and_award_badges(session, user)
-                        
-                        session.commit()
-                        session.close()
-                        
-                        total_messages += 1
-                        new_messages += 1
-                        if total_messages % 100 == 0:
-                            logger.info(f"Processed {total_messages} messages ({new_messages} new)...")
-                            
-                    except Exception as e:
-                        logger.error(f"Error processing message {message.id}: {str(e)}")
-                        if session:
-                            session.rollback()
-                            session.close()
-                            
-                logger.info(f"Completed fetching from {channel.name}")
-                
-            except discord.Forbidden:
-                logger.warning(f"No access to channel: {channel.name}")
-            except Exception as e:
-                logger.error(f"Error fetching from {channel.name}: {str(e)}")
+    for done, channel_id in enumerate(list(tracked_channels), start=1):
+        channel = bot.get_channel(channel_id)
+        if not channel:
+            logger.warning(f"Could not find channel with ID: {channel_id}")
+            continue
+        
+        # A cancelled backfill (the channel stopped being tracked) comes back as an exception
+        result, = await asyncio.gather(start_backfill(channel), return_exceptions=True)
+        if isinstance(result, tuple):
+            total_messages += result[0]
+            new_messages += result[1]
+        if progress:
+            progress(done, total_messages, new_messages)
     
     logger.info(f"Message history fetch completed! Total messages processed: {total_messages} ({new_messages} new)")
     return total_messages, new_messages
@@ -106,70 +145,38 @@ async def post_initial_leaderboard():
     """Post the initial leaderboard message in the designated channel."""
     global last_leaderboard_message
     
-    print("A. Starting post_initial_leaderboard function")
-    session = None
     try:
-        print(f"B. Getting channel {LEADERBOARD_CHANNEL_ID}")
         channel = bot.get_channel(LEADERBOARD_CHANNEL_ID)
         if not channel:
-            print(f"Error: Could not find channel {LEADERBOARD_CHANNEL_ID}")
             logger.error(f"Could not find leaderboard channel with ID: {LEADERBOARD_CHANNEL_ID}")
             return
-            
-        print(f"C. Found channel: {channel.name}")
-        
-        print("D. Creating database session")
-        session = Session()
         
-        print("E. Creating database tables")
-        Base.metadata.create_all(engine)
-        
-        print("F. Querying users")
-        users = session.query(User).order_by(User.total_messages.desc()).all()
-        print(f"G. Found {len(users)} users")
+        users = await scheduler.submit(load_leaderboard_users)
+        logger.debug(f"Found {len(users)} users")
         
         if not users:
-            print("H. No users found, sending message")
             await channel.send("No activity recorded yet! The leaderboard will update as users send messages.")
             return
             
-        print("I. Getting recent messages for users")
-        for user in users:
-            user.recent_messages = get_recent_messages(session, user.id)
-            
-        print("J. Creating embed")
         embed = create_leaderboard_embed(channel.guild, users, 0)
         
-        try:
-            if last_leaderboard_message:
-                print("K. Deleting old message")
-                await last_leaderboard_message.delete()
-        except Exception as e:
-            print(f"Warning: Could not delete old message: {e}")
+        if last_leaderboard_message:
+            outbound.delete(last_leaderboard_message)
         
-        print("L. Sending new message")
-        last_leaderboard_message = await channel.send(embed=embed)
-        print("M. Message sent")
+        last_leaderboard_message = await outbound.send(channel, embed=embed)
         
         if len(users) > 10:
-            print("N. Adding reactions")
-            await last_leaderboard_message.add_reaction('⬅️')
-            await last_leaderboard_message.add_reaction('➡️')
-            print("O. Reactions added")
+            outbound.add_reaction(last_leaderboard_message, '⬅️')
+            outbound.add_reaction(last_leaderboard_message, '➡️')
             
-        print("P. Leaderboard posted successfully")
+        logger.debug("Leaderboard posted successfully")
     except Exception as e:
-        print(f"Error in post_initial_leaderboard: {str(e)}")
         logger.error(f"Error posting initial leaderboard: {str(e)}", exc_info=True)
-    finally:
-        if session:
-            print("Q. Closing session")
-            session.close()
 
 @bot.event
 async def on_ready():
     """Handle bot startup."""
-    print("1. Bot ready event triggered")
+    global api_runner
     logger.info(f'Bot is ready! Logged in as {bot.user.name} ({bot.user.id})')
     
     # Check bot permissions
@@ -191,44 +198,61 @@ async def on_ready():
         
         if missing_permissions:
             logger.error(f"Missing required permissions in channel {channel.name}: {', '.join(missing_permissions)}")
-            print(f"⚠️ Bot is missing required permissions: {', '.join(missing_permissions)}")
             return
     
     # Log the guilds the bot is in
     for guild in bot.guilds:
-        print(f"2. Found guild: {guild.name}")
         logger.info(f'Bot is in guild: {guild.name} (ID: {guild.id})')
         logger.info(f'Command channels configured: {COMMAND_CHANNELS}')
-        logger.info(f'Tracked channels configured: {TRACKED_CHANNEL_IDS}')
     
-    print("3. About to fetch message history")
+    # Work out which channels to track from the category before fetching anything
+    tracked_channels.refresh(bot.guilds)
+    logger.info(f'Tracked channels: {sorted(tracked_channels.ids)}')
+    
+    # Scoring weights may have changed since the scores were stored
+    try:
+        await scheduler.submit(recompute_scores)
+    except Exception as e:
+        logger.error(f"Error recomputing scores: {str(e)}", exc_info=True)
+    
+    # Restore leaderboard and activity state from the snapshot, or rebuild it,
+    # before new messages start arriving
+    try:
+        await scheduler.submit(load_state)
+    except Exception as e:
+        logger.error(f"Error loading leaderboard state: {str(e)}", exc_info=True)
+    
+    # Serve dashboards once the state is loaded; on_ready fires again after reconnects
+    if API_ENABLED and api_runner is None:
+        try:
+            api_runner = await start_api()
+        except Exception as e:
+            logger.error(f"Error starting JSON API: {str(e)}", exc_info=True)
+    
     # Fetch initial message history first
     try:
         total_messages, new_messages = await fetch_message_history()
-        print(f"4. Message history fetched: {total_messages} messages")
         logger.info(f"Initial message fetch completed: {total_messages} messages processed ({new_messages} new)")
     except Exception as e:
-        print(f"Error in message fetch: {str(e)}")
         logger.error(f"Error during initial message fetch: {str(e)}", exc_info=True)
 
-    print("5. About to wait 2 seconds")
     # Wait a short moment to ensure everything is initialized
     await asyncio.sleep(2)
     
-    print("6. About to post initial leaderboard")
     # Post initial leaderboard
     try:
         await post_initial_leaderboard()
-        print("7. Initial leaderboard posted")
     except Exception as e:
-        print(f"Error posting leaderboard: {str(e)}")
         logger.error(f"Error in on_ready while posting leaderboard: {str(e)}", exc_info=True)
     
-    print("8. Starting background tasks")
     # Start background tasks
     update_leaderboard.start()
     backup_database.start()
-    print("9. Bot startup complete")
+    flush_engagement.start()
+    save_snapshot.start()
+    bot.loop.create_task(compact_old_seasons())
+    bot.loop.create_task(report_untracked_channels())
+    logger.info("Bot startup complete")
 
 @bot.command(name='fetch')
 async def fetch_messages(ctx: Context):
@@ -239,8 +263,15 @@ async def fetch_messages(ctx: Context):
         
     try:
         status_message = await ctx.send("📥 Starting message fetch...")
-        total_messages, new_messages = await fetch_message_history()
-        await status_message.edit(
+        channel_count = len(tracked_channels)
+        
+        # Edits still queued are replaced by newer ones, so only the latest progress is sent
+        def report_progress(done: int, total_messages: int, new_messages: int):
+            outbound.edit(status_message, content=f"📥 Fetching messages... {done}/{channel_count} channels, "
+                                                  f"{total_messages} processed ({new_messages} new)")
+        
+        total_messages, new_messages = await fetch_message_history(report_progress)
+        await outbound.edit(status_message,
             content=f"✅ Message fetch completed!\n"
                    f"• Total messages processed: {total_messages}\n"
                    f"• New messages added: {new_messages}"
@@ -249,35 +280,91 @@ async def fetch_messages(ctx: Context):
         logger.error(f"Error during manual message fetch: {str(e)}")
         await ctx.send(f"❌ Error during message fetch: {str(e)}")
 
+@bot.command(name='prune')
+async def prune_channels(ctx: Context, confirm: Optional[str] = None):
+    """List channels with stored messages that are no longer tracked; `!prune confirm` uncounts them."""
+    if ctx.author.id not in ADMIN_IDS:
+        await ctx.send("❌ You don't have permission to use this command.")
+        return
+    
+    try:
+        stale = await find_untracked_channels()
+    except Exception as e:
+        logger.error(f"Error checking for untracked channels: {str(e)}")
+        await ctx.send(f"❌ Error checking for untracked channels: {str(e)}")
+        return
+    if stale is None:
+        await ctx.send("⚠️ Some servers are unavailable or no channels are tracked, so untracked channels can't be told apart. Try again later.")
+        return
+    if not stale:
+        await ctx.send("✅ Every channel with stored messages is still tracked.")
+        return
+    
+    channel_list = ', '.join(f'<#{channel_id}>' for channel_id in stale)
+    if confirm != 'confirm':
+        await ctx.send(f"{len(stale)} channels with stored messages are no longer tracked: {channel_list}\n"
+                       f"Run `!prune confirm` to uncount their messages (a backup is taken first).")
+        return
+    
+    status_message = await ctx.send(f"🧹 Uncounting messages from {len(stale)} channels...")
+    removed = await untrack_channels(stale, f'pruned by {ctx.author}')
+    if removed is None:
+        await outbound.edit(status_message, content="❌ Could not uncount the messages; check the logs.")
+    else:
+        await outbound.edit(status_message, content=f"✅ Uncounted {removed} messages from {channel_list}")
+
+@bot.command(name='queue')
+async def show_queue(ctx: Context):
+    """Show work scheduler and Discord API queue statistics."""
+    if ctx.author.id not in ADMIN_IDS:
+        await ctx.send("❌ You don't have permission to use this command.")
+        return
+    
+    stats = scheduler.stats()
+    totals = stats.pop('totals')
+    embed = discord.Embed(title="⚙️ Work Scheduler", color=0x808080)
+    for lane, lane_stats in stats.items():
+        embed.add_field(
+            name=lane.capitalize(),
+            value=(f"Queued: **{lane_stats['depth']}**\n"
+                   f"Completed: **{lane_stats['completed']}**\n"
+                   f"Wait p50/p99: **{lane_stats['p50_ms']:.0f}/{lane_stats['p99_ms']:.0f}** ms\n"
+                   f"Max wait: **{lane_stats['max_ms']:.0f}** ms"),
+            inline=True
+        )
+    api = outbound.stats()
+    embed.add_field(
+        name="Discord API",
+        value=(f"Calls: **{api['calls']}** of **{api['requested']}** requested\n"
+               f"Saved: **{api['coalesced_edits']}** coalesced edits, **{api['bulk_delete_saved']}** by bulk delete\n"
+               f"Queued: **{api['queued']}**\n"
+               f"Held by budgets: **{api['throttled_s']:.1f}** s\n"
+               f"429s: **{api['rate_limited']}** (**{api['rate_limited_s']:.1f}** s)"),
+        inline=False
+    )
+    embed.set_footer(text=f"{totals['slices']} background slices • "
+                          f"{totals['target_misses']} interactive waits over target")
+    await ctx.send(embed=embed)
+
 @bot.event
 async def on_command_error(ctx, error):
     """Handle command errors."""
     logger.info(f"Command error triggered: {type(error).__name__} - {str(error)}")
     
     if isinstance(error, commands.errors.CommandNotFound):
-        await ctx.send(f"Command not found. Available commands: `!leaderboard` (or `!lb`), `!stats [user]`, `!reset` (admin only), `!fetch` (admin only)")
+        await ctx.send(f"Command not found. Available commands: `!leaderboard` (or `!lb`), `!stats [user]`, `!activity [user|server]`, `!season`, `!reset` (admin only), `!fetch` (admin only), `!prune` (admin only), `!queue` (admin only)")
     elif isinstance(error, commands.errors.MissingPermissions):
         await ctx.send("You don't have permission to use this command.")
     elif isinstance(error, commands.errors.NoPrivateMessage):
         await ctx.send("This command can only be used in a server.")
+    elif isinstance(error, commands.errors.BadArgument):
+        if ctx.command and ctx.command.name == 'leaderboard':
+            await ctx.send(LEADERBOARD_USAGE)
+        else:
+            await ctx.send(f"Invalid argument: {str(error)}")
     else:
         logger.error(f"Unhandled command error in {ctx.command}: {str(error)}")
 
-class DatabaseSession:
-    """Context manager for database sessions."""
-    def __init__(self):
-        self.session = None
-    
-    async def __aenter__(self):
-        self.session = Session()
-        return self.session
-    
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.session:
-            if exc_type is not None:
-                self.session.rollback()
-            self.session.close()
-
 @tasks.loop(hours=1)
 async def update_leaderboard():
     """Update the leaderboard message hourly at minute 00."""
@@ -292,39 +379,32 @@ async def update_leaderboard():
         logger.error(f"Could not find leaderboard channel with ID: {LEADERBOARD_CHANNEL_ID}")
         return
         
-    async with DatabaseSession() as session:
-        try:
-            # Delete previous hourly leaderboard messages
-            async for message in channel.history(limit=100):
-                if message.author == bot.user and not hasattr(message, 'manual_leaderboard'):
-                    try:
-                        await message.delete()
-                    except discord.NotFound:
-                        pass
-                    except Exception as e:
-                        logger.error(f"Error deleting message: {str(e)}")
-            
-            users = session.query(User).order_by(User.total_messages.desc()).all()
-            
-            if not users:
-                return
-                
-            for user in users:
-                user.recent_messages = get_recent_messages(session, user.id)
-                
-            guild = channel.guild
-            embed = create_leaderboard_embed(guild, users, 0)
+    try:
+        # Delete previous hourly leaderboard messages, in bulk where Discord allows it
+        stale = [message async for message in channel.history(limit=100)
+                 if message.author == bot.user and not hasattr(message, 'manual_leaderboard')]
+        failed = await outbound.delete_messages(stale)
+        if failed:
+            logger.error(f"Could not delete {failed} old leaderboard messages")
+        
+        users = await scheduler.submit(load_leaderboard_users)
+        
+        if not users:
+            return
             
-            # Send new leaderboard message
-            new_message = await channel.send(embed=embed)
+        guild = channel.guild
+        embed = create_leaderboard_embed(guild, users, 0)
+        
+        # Send new leaderboard message
+        new_message = await outbound.send(channel, embed=embed)
+        
+        # Add pagination reactions if there are more than 10 users
+        if len(users) > 10:
+            outbound.add_reaction(new_message, '⬅️')
+            outbound.add_reaction(new_message, '➡️')
             
-            # Add pagination reactions if there are more than 10 users
-            if len(users) > 10:
-                await new_message.add_reaction('⬅️')
-                await new_message.add_reaction('➡️')
-                
-        except Exception as e:
-            logger.error(f"Error updating leaderboard: {str(e)}")
+    except Exception as e:
+        logger.error(f"Error updating leaderboard: {str(e)}")
 
 @update_leaderboard.before_loop
 async def before_update_leaderboard():
@@ -342,6 +422,32 @@ async def backup_database():
     except Exception as e:
         logger.error(f"Error during database backup: {str(e)}")
 
+@tasks.loop(seconds=ENGAGEMENT_FLUSH_INTERVAL)
+async def flush_engagement():
+    """Periodically apply buffered reply and reaction counts."""
+    try:
+        await scheduler.submit(engagement_tracker.flush)
+    except Exception as e:
+        logger.error(f"Error flushing engagement counters: {str(e)}")
+
+@tasks.loop(seconds=SNAPSHOT_INTERVAL)
+async def save_snapshot():
+    """Periodically write the warm-restart snapshot."""
+    try:
+        await scheduler.submit(save_state, lane=BACKGROUND)
+    except Exception as e:
+        logger.error(f"Error writing state snapshot: {str(e)}")
+
+@save_snapshot.before_loop
+async def before_save_snapshot():
+    """Skip the immediate first run; the state was just loaded."""
+    await asyncio.sleep(SNAPSHOT_INTERVAL)
+
+def save_state():
+    """Apply buffered engagement counts, then write the snapshot so it matches the database."""
+    engagement_tracker.flush()
+    write_snapshot()
+
 @bot.event
 async def on_message(message):
     """Handle new messages."""
@@ -352,89 +458,140 @@ async def on_message(message):
     await bot.process_commands(message)
     
     # Only track messages in tracked channels
-    if message.channel.id not in TRACKED_CHANNEL_IDS:
+    if message.channel.id not in tracked_channels:
         return
         
     try:
-        session = Session()
-        
-        # Update user stats
-        user = update_user_stats(session, str(message.author.id), message.created_at)
-        
-        # Store message
-        db_message = Message(
-            discord_message_id=str(message.id),
-            user_id=user.id,
-            channel_id=str(message.channel.id),
-            timestamp=message.created_at
+        await scheduler.submit(store_message, *message_record(message))
+    except Exception as e:
+        logger.error(f"Error processing message: {str(e)}")
+
+def find_user(discord_id: int) -> Optional[User]:
+    """Look up a user's current-season stats by Discord ID with their badges loaded."""
+    session = Session()
+    try:
+        return (
+            session.query(User)
+            .options(selectinload(User.badges).selectinload(UserBadge.badge))
+            .filter_by(season_id=current_season(session).id, discord_id=discord_id)
+            .first()
         )
-        session.add(db_message)
-        
-        # Check and award badges
-        check_and_award_badges(session, user)
-        
-        session.commit()
+    finally:
         session.close()
-        
+
+def begin_new_season():
+    """Switch to a new season; the previous one is kept as-is."""
+    season = start_new_season()
+    activity_matrix.clear()
+    standings.reset(season.id)
+    return season
+
+async def compact_old_seasons():
+    """Archive ended seasons that are past the message retention window."""
+    due = seasons_to_compact()
+    if not due:
+        return
+    
+    # Per-message rows are about to be deleted, so keep a copy first
+    if not await create_backup():
+        logger.warning("Skipping season compaction because the backup failed")
+        return
+    for season in due:
+        try:
+            deleted = await scheduler.run_sliced(compact_season(season.id), name=f'compact season {season.number}')
+            logger.info(f"Archived season {season.number} ({deleted} message rows compacted)")
+        except Exception as e:
+            logger.error(f"Error compacting season {season.number}: {str(e)}", exc_info=True)
+
+async def untrack_channels(channel_ids: list, reason: str) -> Optional[int]:
+    """Stop counting every stored message from channels that are no longer tracked.
+
+    Returns the number of messages uncounted, or None if nothing was done.
+    """
+    await cancel_backfills(channel_ids)
+    
+    # Message rows are about to be deleted, so keep a copy first
+    if not await create_backup():
+        logger.warning(f"Not uncounting messages from channels {channel_ids} because the backup failed")
+        return None
+    try:
+        removed = await scheduler.run_sliced(delete_channel_messages(channel_ids), name='untrack channels')
+        logger.info(f"Uncounted {removed} messages from channels {channel_ids} ({reason})")
+        return removed
     except Exception as e:
-        logger.error(f"Error processing message: {str(e)}")
-        if session:
-            session.rollback()
-            session.close()
-
-def get_recent_messages(session: Session, user_id: int) -> int:
-    """Get the number of messages sent by a user in the last 24 hours."""
-    yesterday = datetime.utcnow() - timedelta(days=1)
-    return session.query(Message).filter(
-        Message.user_id == user_id,
-        Message.timestamp >= yesterday
-    ).count()
+        logger.error(f"Error uncounting messages from channels {channel_ids}: {str(e)}", exc_info=True)
+        return None
+
+async def find_untracked_channels() -> Optional[list]:
+    """Channels with stored messages that are not tracked any more, or None if that can't be told.
+
+    A partial guild cache or a misconfigured category would make every channel
+    look untracked, so nothing is reported unless every guild is available and
+    at least one channel is tracked.
+    """
+    if not tracked_channels.complete or not tracked_channels.ids:
+        logger.warning("Not checking for untracked channels: the tracked channel set is incomplete or empty")
+        return None
+    return sorted(await scheduler.submit(load_stored_channel_ids, lane=BACKGROUND) - tracked_channels.ids)
+
+async def report_untracked_channels():
+    """Log channels that stopped being tracked while the bot was down; an admin uncounts them with `!prune`."""
+    try:
+        stale = await find_untracked_channels()
+    except Exception as e:
+        logger.error(f"Error checking for untracked channels: {str(e)}")
+        return
+    if stale:
+        logger.warning(f"Stored messages from {len(stale)} channels that are no longer tracked: {stale}. "
+                       f"Run `!prune confirm` to uncount them.")
+
+def load_stored_channel_ids() -> set:
+    """Channels that have stored messages."""
+    with engine.connect() as conn:
+        return stored_channel_ids(conn)
+
+LEADERBOARD_USAGE = "Usage: `!leaderboard` or `!leaderboard season <number>`"
 
 @bot.command(name='leaderboard', aliases=['lb'])
-async def show_leaderboard(ctx: Context):
-    """Display the server leaderboard."""
+async def show_leaderboard(ctx: Context, scope: Optional[str] = None, number: Optional[int] = None):
+    """Display the server leaderboard, optionally for a past season (`!lb season 3`)."""
     global current_page
     
-    logger.info(f"Starting leaderboard command from {ctx.author} in channel {ctx.channel.id}")
+    logger.info(f"Leaderboard command used by {ctx.author} in channel {ctx.channel.id}")
     current_page = 0  # Reset to first page
     
-    session = None
+    season = None
+    if scope is not None:
+        if scope.lower() != 'season' or number is None:
+            await ctx.send(LEADERBOARD_USAGE)
+            return
+        season = find_season(number)
+        if not season:
+            await ctx.send(f"Season {number} does not exist.")
+            return
+    
     try:
-        logger.info("Creating database session")
-        session = Session()
-        
-        logger.info("Querying users from database")
-        users = session.query(User).order_by(User.total_messages.desc()).all()
-        logger.info(f"Found {len(users)} users")
+        users = await scheduler.run_interactive(load_leaderboard_users, season.id if season else None)
+        logger.debug(f"Found {len(users)} users")
         
         if not users:
             await ctx.send("No activity recorded yet!")
             return
             
-        logger.info("Getting recent messages for users")
-        for user in users:
-            user.recent_messages = get_recent_messages(session, user.id)
-            
-        logger.info("Creating leaderboard embed")
-        embed = create_leaderboard_embed(ctx.guild, users, current_page)
+        embed = create_leaderboard_embed(ctx.guild, users, current_page, season=season)
         
-        logger.info("Sending new leaderboard message")
         message = await ctx.send(embed=embed)
         # Mark the message as manually called
         setattr(message, 'manual_leaderboard', True)
+        if season:
+            leaderboard_seasons[message.id] = season
         
         if len(users) > 10:
-            logger.info("Adding pagination reactions")
-            await message.add_reaction('⬅️')
-            await message.add_reaction('➡️')
+            outbound.add_reaction(message, '⬅️')
+            outbound.add_reaction(message, '➡️')
             
-        logger.info("Leaderboard command completed successfully")
     except Exception as e:
         logger.error(f"Error showing leaderboard: {type(e).__name__} - {str(e)}", exc_info=True)
-    finally:
-        if session:
-            logger.info("Closing database session")
-            session.close()
 
 @bot.command(name='stats')
 async def show_stats(ctx: Context, member: discord.Member = None):
@@ -444,8 +601,7 @@ async def show_stats(ctx: Context, member: discord.Member = None):
     member = member or ctx.author
     
     try:
-        session = Session()
-        user = session.query(User).filter_by(discord_id=str(member.id)).first()
+        user = await scheduler.run_interactive(find_user, member.id)
         
         if not user:
             await ctx.send(f"{member.display_name} has no recorded activity yet!")
@@ -453,45 +609,119 @@ async def show_stats(ctx: Context, member: discord.Member = None):
             
         embed = create_user_stats_embed(member, user)
         await ctx.send(embed=embed)
-        
-        session.close()
     except Exception as e:
         logger.error(f"Error showing user stats: {str(e)}")
         await ctx.send("An error occurred while fetching user statistics.")
-        if session:
-            session.close()
+
+@bot.command(name='activity')
+async def show_activity(ctx: Context, target: Optional[Union[discord.Member, str]] = None):
+    """Display an activity heatmap for a user or the whole server."""
+    logger.info(f"Activity command used by {ctx.author} in channel {ctx.channel.id}")
+    
+    if isinstance(target, str) and target.lower() != 'server':
+        await ctx.send(f"Could not find a member named {target}. Use `!activity [user|server]`.")
+        return
+    
+    try:
+        if isinstance(target, str):
+            counts = activity_matrix.server_counts()
+            first_active = activity_matrix.server_first_active()
+            title = f"Server Activity for {ctx.guild.name}" if ctx.guild else "Server Activity"
+        else:
+            member = target or ctx.author
+            user = await scheduler.run_interactive(find_user, member.id)
+            
+            counts = activity_matrix.user_counts(user.id) if user else None
+            if counts is None:
+                await ctx.send(f"{member.display_name} has no recorded activity yet!")
+                return
+            first_active = activity_matrix.user_first_active(user.id)
+            title = f"Activity for {member.display_name}"
+        
+        summary = summarize_activity(counts, first_active)
+        await ctx.send(embed=create_activity_embed(title, summary, counts))
+    except Exception as e:
+        logger.error(f"Error showing activity: {str(e)}", exc_info=True)
+        await ctx.send("An error occurred while fetching activity statistics.")
 
 @bot.command(name='reset')
 async def reset_stats(ctx: Context):
-    """Reset all leaderboard statistics."""
+    """Reset the leaderboard by starting a new season."""
     logger.info(f"Reset command used by {ctx.author} in channel {ctx.channel.id}")
     
     if ctx.author.id not in ADMIN_IDS:
         await ctx.send("❌ You don't have permission to use this command.")
         return
-        
+    
+    await start_season(ctx)
+
+@bot.group(name='season', invoke_without_command=True)
+async def show_season(ctx: Context):
+    """Show the current season."""
+    season = current_season()
+    await ctx.send(f"📅 Season **{season.number}** started {season.started_at:%Y-%m-%d}. "
+                   f"Past seasons can be viewed with `!leaderboard season <number>`.")
+
+@show_season.command(name='new')
+async def start_season(ctx: Context):
+    """End the current season and start a new one."""
+    if ctx.author.id not in ADMIN_IDS:
+        await ctx.send("❌ You don't have permission to use this command.")
+        return
+    
     try:
-        # Create backup before reset
-        await create_backup()
-        
-        session = Session()
-        
-        # Clear all data
-        session.query(UserBadge).delete()
-        session.query(Message).delete()
-        session.query(ActivityPattern).delete()
-        session.query(User).delete()
-        
-        session.commit()
-        session.close()
-        
-        await ctx.send("✅ All statistics have been reset and a backup has been created.")
+        previous = current_season()
+        season = await scheduler.submit(begin_new_season)
+        await ctx.send(f"✅ Season {previous.number} has ended and season {season.number} has started. "
+                       f"Use `!leaderboard season {previous.number}` to see the final standings.")
     except Exception as e:
-        logger.error(f"Error resetting stats: {str(e)}")
-        await ctx.send("An error occurred while resetting statistics.")
-        if session:
-            session.rollback()
-            session.close()
+        logger.error(f"Error starting a new season: {str(e)}")
+        await ctx.send("An error occurred while starting a new season.")
+        return
+    
+    bot.loop.create_task(compact_old_seasons())
+
+@bot.event
+async def on_raw_message_delete(payload):
+    """Stop counting a deleted message, whether or not it was in the client cache."""
+    if payload.channel_id not in tracked_channels:
+        return
+    try:
+        await scheduler.submit(delete_messages, [payload.message_id])
+    except Exception as e:
+        logger.error(f"Error processing message deletion: {str(e)}")
+
+@bot.event
+async def on_raw_bulk_message_delete(payload):
+    """Stop counting messages removed by a bulk delete."""
+    if payload.channel_id not in tracked_channels:
+        return
+    try:
+        removed = await scheduler.submit(delete_messages, list(payload.message_ids))
+        logger.info(f"Bulk delete in channel {payload.channel_id}: uncounted {removed} messages")
+    except Exception as e:
+        logger.error(f"Error processing bulk message deletion: {str(e)}")
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    """Stop counting the messages of a tracked channel that was deleted."""
+    if tracked_channels.discard(channel.id):
+        await untrack_channels([channel.id], 'channel deleted')
+
+@bot.event
+async def on_guild_channel_create(channel):
+    """Start tracking a channel created in the tracked category."""
+    if tracked_channels.update(channel) == ADDED:
+        start_backfill(channel)
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    """Track or untrack a channel moved into or out of the tracked category."""
+    change = tracked_channels.update(after)
+    if change == ADDED:
+        start_backfill(after)
+    elif change == REMOVED:
+        await untrack_channels([after.id], 'moved out of the tracked category')
 
 @bot.event
 async def on_reaction_add(reaction, user):
@@ -501,57 +731,53 @@ async def on_reaction_add(reaction, user):
         
     # Handle pagination reactions
     if reaction.message.author == bot.user and len(reaction.message.embeds) > 0:
-        message_id = str(reaction.message.id)
+        message_id = reaction.message.id
         current_page = message_pages.get(message_id, 0)
+        season = leaderboard_seasons.get(message_id)
         
         try:
-            async with DatabaseSession() as session:
-                users = session.query(User).order_by(User.total_messages.desc()).all()
-                max_pages = (len(users) - 1) // 10
-                
-                # Get recent messages for each user
-                for user in users:
-                    user.recent_messages = get_recent_messages(session, user.id)
-                
-                if str(reaction.emoji) == '➡️' and current_page < max_pages:
-                    current_page += 1
-                    message_pages[message_id] = current_page
-                    embed = create_leaderboard_embed(reaction.message.guild, users, current_page)
-                    await reaction.message.edit(embed=embed)
-                elif str(reaction.emoji) == '⬅️' and current_page > 0:
-                    current_page -= 1
-                    message_pages[message_id] = current_page
-                    embed = create_leaderboard_embed(reaction.message.guild, users, current_page)
-                    await reaction.message.edit(embed=embed)
-                    
-                # Try to remove the user's reaction with better error handling
-                try:
-                    await reaction.remove(user)
-                except discord.Forbidden:
-                    logger.warning(f"Bot lacks permission to remove reactions in channel {reaction.message.channel.id}")
-                except Exception as e:
-                    logger.error(f"Error removing reaction: {str(e)}")
+            users = await scheduler.run_interactive(load_leaderboard_users, season.id if season else None)
+            max_pages = (len(users) - 1) // 10
+            
+            if str(reaction.emoji) == '➡️' and current_page < max_pages:
+                current_page += 1
+                message_pages[message_id] = current_page
+                embed = create_leaderboard_embed(reaction.message.guild, users, current_page, season=season)
+                outbound.edit(reaction.message, embed=embed)
+            elif str(reaction.emoji) == '⬅️' and current_page > 0:
+                current_page -= 1
+                message_pages[message_id] = current_page
+                embed = create_leaderboard_embed(reaction.message.guild, users, current_page, season=season)
+                outbound.edit(reaction.message, embed=embed)
                 
+            # Page flips are queued, so quick flips only send the page the user ended on
+            outbound.remove_reaction(reaction.message, reaction.emoji, user)
+            
         except Exception as e:
             logger.error(f"Error handling pagination: {str(e)}")
             return
 
-    # Handle message reactions
-    try:
-        async with DatabaseSession() as session:
-            message = session.query(Message).filter_by(
-                discord_message_id=str(reaction.message.id)
-            ).first()
-            
-            if message:
-                message.reaction_count += 1
-                session.commit()
-                
-    except Exception as e:
-        logger.error(f"Error processing reaction: {str(e)}")
+    # Count the reaction; it is applied with the next engagement flush
+    engagement_tracker.add_reaction(reaction.message.id, user.id)
+
+@bot.event
+async def on_reaction_remove(reaction, user):
+    """Handle reaction removals."""
+    if user.bot:
+        return
+    engagement_tracker.add_reaction(reaction.message.id, user.id, -1)
 
 if __name__ == "__main__":
     try:
-        bot.run(TOKEN)
+        # Logging is already routed through our queue pipeline
+        bot.run(TOKEN, log_handler=None)
+    except Exception as e:
+        logger.error(f"Error running bot: {str(e)}")
+    
+    # bot.run returns once the bot has closed; persist state for a warm restart
+    try:
+        scheduler.shutdown()
+        if standings.ready:
+            save_state()
     except Exception as e:
-        logger.error(f"Error running bot: {str(e)}")
\ No newline at end of file
+        logger.error(f"Error writing state snapshot on shutdown: {str(e)}")
\ No newline at end of file
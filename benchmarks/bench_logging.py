@@ -0,0 +1,115 @@
+"""Measure what logging costs the calling thread on the ingest hot path.
+
+Compares the old synchronous setup (StreamHandler + FileHandler writing on the
+caller's thread) with ``utils.setup_logging`` (queue handler, background
+listener, rotating file). Each iteration logs what one ingested message would,
+plus the periodic progress line, and the time each message spends in logging
+calls on the calling thread is reported (mean, p99 and worst case). File writes
+get an artificial per-write delay to model a disk that is not instantly fast.
+
+Usage: python benchmarks/bench_logging.py [--messages N] [--work-us US] [--disk-latency-us US]
+"""
+import argparse
+import atexit
+import logging
+import os
+import sys
+import tempfile
+import time
+
+# utils imports the models, so point them at a throwaway database first
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'logging.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import setup_logging  # noqa: E402
+
+class SlowStream:
+    """File stream wrapper that adds a fixed delay to every write, like a busy or remote disk."""
+    def __init__(self, stream, latency: float):
+        self._stream = stream
+        self._latency = latency
+
+    def write(self, data):
+        time.sleep(self._latency)
+        return self._stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+def slow_down_files(handlers, latency: float):
+    for handler in handlers:
+        if isinstance(handler, logging.FileHandler):
+            handler.stream = SlowStream(handler.stream, latency)
+
+def reset_root():
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+def hot_path(logger: logging.Logger, messages: int, work_seconds: float):
+    """Log like the ingest path and return per-message seconds spent on the calling thread."""
+    durations = []
+    for idx in range(messages):
+        # Stand-in for the database work done per message (not measured)
+        busy_until = time.perf_counter() + work_seconds
+        while time.perf_counter() < busy_until:
+            pass
+
+        start = time.perf_counter()
+        logger.info(f"Stored message {idx} from user {idx % 500}")
+        if idx % 100 == 0:
+            logger.info(f"Processed {idx} messages ({idx} new)...", extra={'sample_every': 10})
+        durations.append(time.perf_counter() - start)
+    return sorted(durations)
+
+def describe(durations) -> str:
+    mean = sum(durations) / len(durations)
+    p99 = durations[int(len(durations) * 0.99)]
+    return (f"mean {mean * 1e6:7.2f} us | p99 {p99 * 1e6:7.2f} us | "
+            f"max {durations[-1] * 1e3:6.2f} ms | total {sum(durations):.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20_000)
+    parser.add_argument('--work-us', type=float, default=200, help='Simulated ingest work per message')
+    parser.add_argument('--disk-latency-us', type=float, default=100, help='Added latency per log file write')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    logger = logging.getLogger('LeaderboardBot')
+    devnull = open(os.devnull, 'w')
+    real_stderr, sys.stderr = sys.stderr, devnull  # Keep console output out of the measurement
+
+    try:
+        reset_root()
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
+            handlers=[logging.StreamHandler(), logging.FileHandler(os.path.join(workdir, 'sync.log'))]
+        )
+        slow_down_files(logging.getLogger().handlers, args.disk_latency_us / 1e6)
+        sync_durations = hot_path(logger, args.messages, args.work_us / 1e6)
+
+        queued = {}
+        for label, rate_limit in (('unlimited', 0), ('rate-limited', None)):
+            reset_root()
+            log_file = os.path.join(workdir, f'{label}.log')
+            listener = setup_logging(log_file) if rate_limit is None else setup_logging(log_file, rate_limit=rate_limit)
+            slow_down_files(listener.handlers, args.disk_latency_us / 1e6)
+            caller_durations = hot_path(logger, args.messages, args.work_us / 1e6)
+            drain_start = time.perf_counter()
+            listener.stop()
+            atexit.unregister(listener.stop)
+            queued[label] = (caller_durations, time.perf_counter() - drain_start)
+    finally:
+        sys.stderr = real_stderr
+        devnull.close()
+
+    print(f"synchronous handlers:        {describe(sync_durations)}")
+    for label, (caller_durations, drain_seconds) in queued.items():
+        print(f"queue pipeline {label:>12}: {describe(caller_durations)} "
+              f"(+{drain_seconds:.2f}s writing off-thread)")
+
+if __name__ == '__main__':
+    main()
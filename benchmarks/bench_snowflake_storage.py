@@ -0,0 +1,102 @@
+"""Compare text vs. 64-bit integer storage for Discord snowflake columns.
+
+Builds two throwaway SQLite databases with the ``users``/``messages`` layout,
+one storing Discord IDs as ``VARCHAR`` (the old schema) and one as ``BIGINT``,
+then reports file size, insert throughput and unique-key lookup throughput.
+
+Usage: python benchmarks/bench_snowflake_storage.py [--messages N] [--users N]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import (
+    create_engine, select, Column, Integer, BigInteger, String, DateTime, ForeignKey, MetaData, Table
+)
+
+DISCORD_EPOCH_MS = 1420070400000
+
+def make_snowflake(rng: random.Random, when: datetime) -> int:
+    """Build a realistic snowflake for a given timestamp."""
+    ms = int(when.timestamp() * 1000) - DISCORD_EPOCH_MS
+    return (ms << 22) | rng.getrandbits(22)
+
+def build_tables(id_type) -> MetaData:
+    metadata = MetaData()
+    Table('users', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('discord_id', id_type, unique=True),
+          Column('total_messages', Integer, default=0))
+    Table('messages', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('discord_message_id', id_type, unique=True),
+          Column('user_id', Integer, ForeignKey('users.id')),
+          Column('channel_id', id_type),
+          Column('timestamp', DateTime))
+    return metadata
+
+def run(label: str, id_type, convert, user_ids, message_rows, lookups):
+    path = os.path.join(tempfile.mkdtemp(), f'{label}.db')
+    engine = create_engine(f'sqlite:///{path}')
+    metadata = build_tables(id_type)
+    metadata.create_all(engine)
+    users, messages = metadata.tables['users'], metadata.tables['messages']
+
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(users.insert(), [
+            {'id': idx, 'discord_id': convert(user_id), 'total_messages': 0}
+            for idx, user_id in enumerate(user_ids, start=1)
+        ])
+        conn.execute(messages.insert(), [
+            {'discord_message_id': convert(message_id), 'user_id': user_idx,
+             'channel_id': convert(channel_id), 'timestamp': timestamp}
+            for message_id, user_idx, channel_id, timestamp in message_rows
+        ])
+    insert_seconds = time.perf_counter() - start
+
+    by_message_id = select(messages.c.id)
+    start = time.perf_counter()
+    with engine.connect() as conn:
+        for message_id in lookups:
+            conn.execute(
+                by_message_id.where(messages.c.discord_message_id == convert(message_id))
+            ).first()
+    lookup_seconds = time.perf_counter() - start
+    engine.dispose()
+
+    size = os.path.getsize(path)
+    print(f"{label:>8}: size {size / 1024 / 1024:8.2f} MiB | "
+          f"insert {len(message_rows) / insert_seconds:10.0f} rows/s | "
+          f"lookup {len(lookups) / lookup_seconds:10.0f} queries/s")
+    return size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200_000)
+    parser.add_argument('--users', type=int, default=2_000)
+    parser.add_argument('--lookups', type=int, default=20_000)
+    parser.add_argument('--seed', type=int, default=26)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    start = datetime(2024, 1, 1)
+    user_ids = [make_snowflake(rng, start - timedelta(days=rng.randint(0, 2000)))
+                for _ in range(args.users)]
+    channel_ids = [make_snowflake(rng, start - timedelta(days=900)) for _ in range(7)]
+    message_rows = []
+    for idx in range(args.messages):
+        timestamp = start + timedelta(seconds=idx * 30)
+        message_rows.append((make_snowflake(rng, timestamp), rng.randint(1, args.users),
+                             rng.choice(channel_ids), timestamp))
+    lookups = [rng.choice(message_rows)[0] for _ in range(args.lookups)]
+
+    text_size = run('string', String, str, user_ids, message_rows, lookups)
+    int_size = run('bigint', BigInteger, int, user_ids, message_rows, lookups)
+    print(f"BIGINT database is {100 * (1 - int_size / text_size):.1f}% smaller")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""Time-to-first-leaderboard after a restart: database rebuild vs. state snapshot.
+
+Fills a throwaway database with synthetic users, message history, activity
+patterns and badges, then times what startup does before the first leaderboard
+can be rendered: rebuilding the in-memory state from the database (cold) or
+restoring it from a snapshot (warm). Run with a few ``--messages`` sizes to see
+how each path scales with history.
+
+Then checks that a snapshot goes stale after changes that leave every counter
+total and the message high-water mark as they were: the newest message deleted
+and replaced by one reusing its row id, and a reaction moving between users.
+Exits non-zero if such a snapshot would still be used.
+
+Usage: python benchmarks/bench_warm_restart.py [--messages 1000000] [--users 5000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Point the models at a throwaway database before they are imported
+workdir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'restart.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text  # noqa: E402
+from models import engine, Session, User, Message, ActivityPattern, UserBadge  # noqa: E402
+from activity import activity_matrix  # noqa: E402
+from standings import standings  # noqa: E402
+from seasons import current_season  # noqa: E402
+from engagement import engagement_tracker  # noqa: E402
+from snapshot import load_state, restore_snapshot, write_snapshot  # noqa: E402
+from utils import load_leaderboard_users, store_message, delete_messages  # noqa: E402
+
+def populate(messages: int, users: int, seed: int):
+    """Bulk-insert consistent synthetic data, bypassing the ingest path for speed."""
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    session = Session()
+    season_id = current_season(session).id
+    session.close()
+
+    totals = [0] * users
+    cells = {}
+    with engine.begin() as conn:
+        batch = []
+        for idx in range(messages):
+            user = rng.randrange(users)
+            timestamp = now - timedelta(seconds=rng.randrange(365 * 86400))
+            totals[user] += 1
+            cell = (user + 1, timestamp.weekday(), timestamp.hour)
+            cells[cell] = cells.get(cell, 0) + 1
+            batch.append({'discord_message_id': 10 ** 17 + idx, 'user_id': user + 1,
+                          'channel_id': 10 ** 15, 'timestamp': timestamp})
+            if len(batch) >= 50_000:
+                conn.execute(Message.__table__.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(Message.__table__.insert(), batch)
+
+        conn.execute(User.__table__.insert(), [
+            {'id': user + 1, 'season_id': season_id, 'discord_id': 10 ** 16 + user,
+             'total_messages': total, 'streak': 1, 'best_streak': 1, 'replies_received': 0,
+             'reactions_received': 0, 'score': float(total), 'first_active_date': now - timedelta(days=365)}
+            for user, total in enumerate(totals)
+        ])
+        conn.execute(ActivityPattern.__table__.insert(), [
+            {'user_id': user_id, 'day_of_week': day, 'hour': hour, 'message_count': count}
+            for (user_id, day, hour), count in cells.items()
+        ])
+        badge_ids = [row[0] for row in conn.execute(text("SELECT id FROM badges"))]
+        conn.execute(UserBadge.__table__.insert(), [
+            {'user_id': user + 1, 'badge_id': rng.choice(badge_ids)} for user in range(0, users, 3)
+        ])
+
+def time_to_first_leaderboard() -> float:
+    start = time.perf_counter()
+    load_state(snapshot_path)
+    load_leaderboard_users()
+    return time.perf_counter() - start
+
+def snapshot_used() -> bool:
+    session = Session()
+    try:
+        return restore_snapshot(session, snapshot_path)
+    finally:
+        session.close()
+
+def stale_snapshot_checks() -> list:
+    """Make offsetting changes after a snapshot and return the ones it did not notice."""
+    session = Session()
+    try:
+        newest = (session.query(Message.id, Message.discord_message_id, User.discord_id, Message.channel_id,
+                                Message.timestamp)
+                  .join(User, User.id == Message.user_id).order_by(Message.id.desc()).first())
+        other = (session.query(Message.discord_message_id).join(User, User.id == Message.user_id)
+                 .filter(User.discord_id != newest.discord_id).order_by(Message.id).first())
+    finally:
+        session.close()
+
+    failures = []
+    write_snapshot(snapshot_path)
+    if not snapshot_used():
+        failures.append('unchanged database')
+
+    # The newest row is deleted and a new message from the same author reuses its id
+    delete_messages([newest.discord_message_id])
+    store_message(newest.discord_message_id + 1, newest.discord_id, newest.channel_id, newest.timestamp)
+    session = Session()
+    reused = session.query(Message.id).filter_by(discord_message_id=newest.discord_message_id + 1).scalar() == newest.id
+    session.close()
+    if snapshot_used():
+        failures.append('newest message replaced' + (' (row id reused)' if reused else ''))
+
+    # A reaction moves from one author's message to another's
+    engagement_tracker.add_reaction(newest.discord_message_id + 1, 1)
+    engagement_tracker.flush()
+    write_snapshot(snapshot_path)
+    engagement_tracker.add_reaction(newest.discord_message_id + 1, 1, -1)
+    engagement_tracker.add_reaction(other.discord_message_id, 1)
+    engagement_tracker.flush()
+    if snapshot_used():
+        failures.append('reaction moved between users')
+    return failures
+
+def main():
+    global snapshot_path
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=5_000)
+    parser.add_argument('--seed', type=int, default=32)
+    args = parser.parse_args()
+    snapshot_path = os.path.join(workdir, 'state.snapshot')
+
+    populate(args.messages, args.users, args.seed)
+
+    cold = time_to_first_leaderboard()
+    write_snapshot(snapshot_path)
+    size = os.path.getsize(snapshot_path)
+
+    activity_matrix.clear()
+    standings.ready = False
+    warm = time_to_first_leaderboard()
+
+    print(f"history: {args.messages} messages, {args.users} users")
+    print(f"cold start (database rebuild): {cold * 1000:8.1f} ms")
+    print(f"warm start (snapshot restore): {warm * 1000:8.1f} ms ({size / 1024:.0f} KiB snapshot)")
+
+    failures = stale_snapshot_checks()
+    for failure in failures:
+        print(f"stale snapshot used after: {failure}")
+    print("stale snapshots rejected" if not failures else f"{len(failures)} stale snapshot checks failed")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Localhost check of the JSON API built by ``api.create_app()``.
+
+Seeds a throwaway database with a few users and messages, loads the in-memory
+standings as startup does, and drives the application through aiohttp's test
+client on localhost: response shapes, ETags and ``304`` answers (that they run
+no scheduler job, and that unknown routes and invalid parameters never get
+one), a new ETag after a stored message, input validation and the per-client
+rate limit. Prints one line per check and exits non-zero if any fails.
+
+Usage: python benchmarks/check_api.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# Point the models at a throwaway database before they are imported
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'api.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp.test_utils import TestClient, TestServer  # noqa: E402
+from api import create_app  # noqa: E402
+from scheduler import scheduler  # noqa: E402
+from snapshot import load_state  # noqa: E402
+from utils import store_message, store_message_batch  # noqa: E402
+
+USERS = 30
+
+def seed_database():
+    """Store a spread of messages, most of them over the last day."""
+    now = datetime.utcnow()
+    records = [
+        (1_000_000 + i, 100 + i % USERS, 10 ** 15, now - timedelta(minutes=37 * i), None)
+        for i in range(USERS * 5)
+    ]
+    job = store_message_batch(records)
+    try:
+        while True:
+            next(job)
+    except StopIteration:
+        pass
+    load_state(os.path.join(tempfile.mkdtemp(), 'missing.snapshot'))
+
+async def run_checks() -> list:
+    failures = []
+
+    def check(name: str, ok: bool, detail: str = ''):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}" + (f" ({detail})" if detail and not ok else ''))
+        if not ok:
+            failures.append(name)
+
+    client = TestClient(TestServer(create_app(rate_limit=40, rate_period=60), host='127.0.0.1'))
+    await client.start_server()
+    try:
+        response = await client.get('/api/leaderboard', params={'per_page': 10})
+        body = await response.json()
+        etag = response.headers.get('ETag')
+        check('leaderboard 200', response.status == 200, str(response.status))
+        check('leaderboard page', body['total'] == USERS and len(body['entries']) == 10 and body['pages'] == 3,
+              str({key: body[key] for key in ('total', 'pages')}))
+        check('snowflakes as strings', isinstance(body['entries'][0]['discord_id'], str))
+        check('ETag present', bool(etag))
+
+        response = await client.get('/api/leaderboard', params={'per_page': 10},
+                                    headers={'If-None-Match': etag})
+        check('matching If-None-Match gives 304', response.status == 304, str(response.status))
+        check('304 carries the ETag', response.headers.get('ETag') == etag)
+
+        def jobs_completed() -> int:
+            return sum(lane['completed'] for name, lane in scheduler.stats().items() if name != 'totals')
+
+        conditional = [('/api/leaderboard', {'per_page': 10, 'page': 2}), ('/api/users/100', {}),
+                       ('/api/rankings', {'hours': 6}), ('/api/rankings', {'days': 30, 'per_page': 5})]
+        tags = {}
+        for path, params in conditional[2:]:
+            # Day windows and rankings have no in-memory count, so the first request loads them
+            tags[path, tuple(params.items())] = (await client.get(path, params=params)).headers.get('ETag')
+        before = jobs_completed()
+        for path, params in conditional:
+            tag = tags.get((path, tuple(params.items())), etag)
+            response = await client.get(path, params=params, headers={'If-None-Match': tag})
+            check(f"{path} {params} unchanged gives 304", response.status == 304, str(response.status))
+        check('304s run no scheduler job', jobs_completed() == before, f"{jobs_completed() - before} jobs")
+
+        for path, params in (('/api/nonexistent', {}), ('/api/leaderboard', {'page': 99}),
+                             ('/api/leaderboard', {'season': 'abc'}), ('/api/rankings', {'hours': 0}),
+                             ('/api/users/abc', {}), ('/api/users/1', {})):
+            response = await client.get(path, params=params, headers={'If-None-Match': '*'})
+            check(f"{path} {params} with If-None-Match: * is not 304", response.status in (400, 404),
+                  str(response.status))
+
+        await scheduler.submit(store_message, 2_000_000, 100, 10 ** 15, datetime.utcnow())
+        response = await client.get('/api/leaderboard', params={'per_page': 10},
+                                    headers={'If-None-Match': etag})
+        check('stored message changes the ETag', response.status == 200 and response.headers.get('ETag') != etag,
+              str(response.status))
+
+        response = await client.get('/api/users/100')
+        body = await response.json()
+        check('user stats', response.status == 200 and body['total_messages'] == 6, str(body.get('total_messages')))
+
+        response = await client.get('/api/rankings', params={'hours': 24})
+        body = await response.json()
+        check('rankings from hourly buckets', response.status == 200 and body['window'] == {'hours': 24}
+              and body['entries'][0]['discord_id'] == '100', str(body.get('entries', [])[:1]))
+        response = await client.get('/api/rankings', params={'days': 30})
+        body = await response.json()
+        check('rankings over days', response.status == 200 and body['total'] == USERS, str(body.get('total')))
+
+        statuses = [(await client.get('/api/leaderboard')).status for _ in range(40)]
+        response = await client.get('/api/leaderboard')
+        check('rate limit gives 429', 429 in statuses or response.status == 429, str(response.status))
+        check('429 carries Retry-After', response.status != 429 or 'Retry-After' in response.headers)
+    finally:
+        await client.close()
+    return failures
+
+def main():
+    seed_database()
+    try:
+        failures = asyncio.run(run_checks())
+    finally:
+        scheduler.shutdown()
+    print(f"{len(failures)} checks failed" if failures else "all checks passed")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,418 @@
+"""Differential check: live incremental stats vs. a reference full recompute.
+
+Generates seeded synthetic event streams (backfill batches, live messages
+arriving out of order, duplicate deliveries, single and bulk deletes, replies
+and reactions), replays each one through the bot's live path (``utils`` ingest
+and delete jobs, the engagement tracker and the in-memory standings) and
+through a plain-Python reference, then diffs every ``User`` field, earned badge
+and activity cell. The reference follows the original one-row-at-a-time rules:
+
+- counters, splits, replies, reactions and score come from the messages that
+  survive, counted from scratch;
+- streaks, first/last activity dates and badges replay the arrival order,
+  because deletes do not reverse them. A message on the day after the last one
+  extends the streak, a later day restarts it, an earlier or same day leaves it;
+  a night-owl hour never counts as early-bird.
+
+Prints throughput for both paths and exits non-zero on any difference, so an
+optimization of the ingest path can be checked with e.g. ``--seeds 20``.
+
+Finally a new season is started, and replies, reactions, message deletes and a
+channel untrack that concern the ended season's messages are checked to leave
+its standings untouched.
+
+Usage: python benchmarks/diff_incremental_stats.py [--seeds 3] [--messages 2000] [--users 40]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+# Point the models at a throwaway database before they are imported
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'diff.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text  # noqa: E402
+from models import engine, Session, Badge  # noqa: E402
+from activity import activity_matrix  # noqa: E402
+from engagement import engagement_tracker, engagement_score  # noqa: E402
+from standings import standings  # noqa: E402
+from seasons import current_season, start_new_season  # noqa: E402
+from utils import store_message, store_message_batch, delete_messages, delete_channel_messages  # noqa: E402
+from config import NIGHT_OWL_HOURS, EARLY_BIRD_HOURS  # noqa: E402
+
+USER_FIELDS = ('total_messages', 'streak', 'best_streak', 'last_active_date', 'first_active_date',
+               'night_owl_messages', 'early_bird_messages', 'weekend_messages', 'weekday_messages',
+               'replies_received', 'reactions_received', 'score')
+STANDINGS_FIELDS = ('total_messages', 'streak', 'best_streak', 'replies_received', 'reactions_received', 'score')
+
+def synthetic_events(seed: int, messages: int, users: int, days: int) -> list:
+    """Build one event stream.
+
+    Events are ('batch', records), ('live', record), ('delete', ids),
+    ('react', message_id, reactor_id, delta) and ('flush',). Records are
+    (message_id, author_id, channel_id, timestamp, reply_to_id). Message IDs grow
+    with the timestamp like snowflakes; the arrival order does not.
+    """
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 5)
+    authors = [10 ** 16 + n for n in range(users)]
+    # Some users post nearly every day (long streaks), others now and then
+    daily = {author: rng.choice((0.95, 0.6, 0.2)) for author in authors}
+    night = {author: rng.random() < 0.3 for author in authors}
+
+    history = []
+    for _ in range(messages):
+        author = rng.choice(authors)
+        day = rng.randrange(days)
+        while rng.random() > daily[author]:
+            day = rng.randrange(days)
+        hour = rng.choice(sorted(NIGHT_OWL_HOURS)) if night[author] and rng.random() < 0.7 else rng.randrange(24)
+        history.append([start + timedelta(days=day, hours=hour, seconds=rng.randrange(3600)), author])
+    history.sort()
+    records = []
+    for idx, (timestamp, author) in enumerate(history):
+        message_id = 10 ** 17 + idx * 1000 + rng.randrange(1000)
+        if rng.random() < 0.5:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)  # Discord hands out aware timestamps
+        reply_to_id = None
+        if records and rng.random() < 0.2:
+            # Mostly earlier messages; some were never delivered, some are self-replies
+            reply_to_id = rng.choice(records)[0] if rng.random() < 0.9 else message_id - 1
+        records.append((message_id, author, 10 ** 15 + rng.randrange(3), timestamp, reply_to_id))
+
+    # Arrival order: mostly chronological with local shuffling
+    arrival = list(records)
+    for idx in range(len(arrival)):
+        if rng.random() < 0.15:
+            other = min(len(arrival) - 1, idx + rng.randrange(1, 50))
+            arrival[idx], arrival[other] = arrival[other], arrival[idx]
+
+    by_id = {record[0]: record for record in records}
+    events, alive, deleted, reactions = [], set(), [], []
+    position = 0
+    while position < len(arrival):
+        if rng.random() < 0.01:
+            # A backfill batch, sometimes newest first like an old-style history fetch
+            batch = arrival[position:position + rng.randrange(20, 200)]
+            position += len(batch)
+            if rng.random() < 0.3:
+                batch = batch[::-1]
+            # Overlap with what was already delivered, as restarts and re-fetches do
+            batch += [by_id[message_id] for message_id in
+                      rng.sample(sorted(alive), min(len(alive), rng.randrange(20)))]
+            events.append(('batch', batch))
+        else:
+            batch = [arrival[position]]
+            position += 1
+            events.append(('live', batch[0]))
+        alive.update(record[0] for record in batch)
+
+        roll = rng.random()
+        if roll < 0.04 and alive:
+            # Deleting an already deleted or never stored message must be a no-op
+            ids = rng.sample(sorted(alive), min(len(alive), rng.choice((1, 1, 1, 5, 30))))
+            if rng.random() < 0.2:
+                ids.append(rng.choice(deleted) if deleted and rng.random() < 0.5 else 10 ** 18 + rng.randrange(10 ** 6))
+            alive.difference_update(ids)
+            deleted.extend(ids)
+            events.append(('delete', ids))
+        elif roll < 0.06 and alive:
+            # Re-delivery of a stored message
+            events.append(('live', by_id[rng.choice(sorted(alive))]))
+        if alive and rng.random() < 0.3:
+            message_id = rng.choice(sorted(alive)) if rng.random() < 0.95 else 10 ** 18 + rng.randrange(10 ** 6)
+            reactor = rng.choice(authors)
+            events.append(('react', message_id, reactor, 1))
+            reactions.append((message_id, reactor))
+        if reactions and rng.random() < 0.03:
+            message_id, reactor = reactions.pop(rng.randrange(len(reactions)))
+            events.append(('react', message_id, reactor, -1))
+        if rng.random() < 0.05:
+            events.append(('flush',))
+    events.append(('flush',))
+    return events
+
+def run_job(job):
+    """Drive a scheduler job generator to completion inline."""
+    try:
+        while True:
+            next(job)
+    except StopIteration as stop:
+        return stop.value
+
+def reset_database():
+    with engine.begin() as conn:
+        for table in ('user_badges', 'activity_patterns', 'messages', 'users'):
+            conn.execute(text(f"DELETE FROM {table}"))
+    activity_matrix.clear()
+    standings.reset(current_season().id)
+    engagement_tracker.flush()
+
+def replay_live(events: list):
+    for event in events:
+        kind = event[0]
+        if kind == 'batch':
+            run_job(store_message_batch(event[1]))
+        elif kind == 'live':
+            store_message(*event[1])
+        elif kind == 'delete':
+            delete_messages(event[1])
+        elif kind == 'react':
+            engagement_tracker.add_reaction(event[1], event[2], event[3])
+        else:
+            engagement_tracker.flush()
+
+def reference_recompute(events: list, badges: list):
+    """Recompute every stat from the event stream; returns (users, badges, cells)."""
+    stored = {}  # message_id -> (author_id, timestamp, reply_to_id), for messages stored at some point
+    alive = set()
+    arrivals = []  # (message_id, author_id, timestamp) in arrival order
+    reactions = defaultdict(int)  # message_id -> net reactions from other users
+    history = []  # arrival and delete events in order, for history-dependent fields
+    for event in events:
+        kind = event[0]
+        if kind in ('batch', 'live'):
+            for message_id, author_id, _, timestamp, reply_to_id in (event[1] if kind == 'batch' else [event[1]]):
+                if message_id in alive:
+                    continue
+                timestamp = timestamp.replace(tzinfo=None)
+                stored[message_id] = (author_id, timestamp, reply_to_id)
+                alive.add(message_id)
+                arrivals.append((message_id, author_id, timestamp))
+                history.append(('message', message_id))
+        elif kind == 'delete':
+            for message_id in set(event[1]) & alive:
+                alive.discard(message_id)
+                history.append(('delete', message_id))
+        elif kind == 'react':
+            _, message_id, reactor_id, delta = event
+            # Reactions only count on messages that are stored and not by their author
+            if message_id in alive and stored[message_id][0] != reactor_id:
+                reactions[message_id] += delta
+
+    users = {}
+
+    def user(author_id):
+        if author_id not in users:
+            users[author_id] = {field: 0 for field in USER_FIELDS}
+            users[author_id].update(last_active_date=None, first_active_date=None, score=0.0)
+        return users[author_id]
+
+    def splits(timestamp):
+        night = timestamp.hour in NIGHT_OWL_HOURS
+        early = not night and timestamp.hour in EARLY_BIRD_HOURS
+        weekend = timestamp.weekday() >= 5
+        return int(night), int(early), int(weekend), int(not weekend)
+
+    # Order-independent counters, from the surviving messages only
+    for message_id in alive:
+        author_id, timestamp, reply_to_id = stored[message_id]
+        stats = user(author_id)
+        night, early, weekend, weekday = splits(timestamp)
+        stats['total_messages'] += 1
+        stats['night_owl_messages'] += night
+        stats['early_bird_messages'] += early
+        stats['weekend_messages'] += weekend
+        stats['weekday_messages'] += weekday
+        stats['reactions_received'] += reactions[message_id]
+        if reply_to_id in alive and stored[reply_to_id][0] != author_id:
+            user(stored[reply_to_id][0])['replies_received'] += 1
+    for stats in users.values():
+        stats['score'] = engagement_score(stats['total_messages'], stats['replies_received'],
+                                          stats['reactions_received'])
+
+    # History-dependent fields, replaying arrivals and deletes in order
+    earned = set()
+    running = defaultdict(lambda: [0, 0, 0, 0])  # total, night owl, early bird, weekend
+    for kind, message_id in history:
+        author_id, timestamp, _ = stored[message_id]
+        night, early, weekend, _ = splits(timestamp)
+        counters = running[author_id]
+        sign = 1 if kind == 'message' else -1
+        for position, value in enumerate((1, night, early, weekend)):
+            counters[position] += sign * value
+        if kind == 'delete':
+            continue
+
+        stats = user(author_id)
+        if stats['last_active_date'] is None:
+            stats['streak'] = 1
+        else:
+            days_diff = (timestamp.date() - stats['last_active_date'].date()).days
+            if days_diff == 1:
+                stats['streak'] += 1
+                stats['best_streak'] = max(stats['streak'], stats['best_streak'])
+            elif days_diff > 1:
+                stats['streak'] = 1
+        stats['last_active_date'] = timestamp
+        if stats['first_active_date'] is None or timestamp < stats['first_active_date']:
+            stats['first_active_date'] = timestamp
+
+        total, night_owl, early_bird, weekend_total = counters
+        shares = {'Night Owl': night_owl, 'Early Bird': early_bird, 'Weekend Warrior': weekend_total}
+        for badge_id, name, requirement_type, requirement_value in badges:
+            if requirement_type == 'percentage' and name in shares:
+                awarded = total > 0 and shares[name] / total * 100 >= requirement_value
+            elif requirement_type == 'streak':
+                awarded = stats['streak'] >= requirement_value
+            else:
+                awarded = False
+            if awarded:
+                earned.add((author_id, badge_id))
+
+    cells = defaultdict(int)
+    for message_id in alive:
+        author_id, timestamp, _ = stored[message_id]
+        cells[(author_id, timestamp.weekday(), timestamp.hour)] += 1
+    return users, earned, {cell: count for cell, count in cells.items() if count}
+
+def live_state():
+    """Read back what the live path stored; returns (users, badges, cells, standings by discord id)."""
+    with engine.connect() as conn:
+        users = {
+            row.discord_id: {field: getattr(row, field) for field in USER_FIELDS}
+            for row in conn.execute(text(f"SELECT discord_id, {', '.join(USER_FIELDS)} FROM users"))
+        }
+        for stats in users.values():
+            for field in ('last_active_date', 'first_active_date'):
+                if isinstance(stats[field], str):
+                    stats[field] = datetime.fromisoformat(stats[field])
+        earned = set(conn.execute(text(
+            "SELECT u.discord_id, ub.badge_id FROM user_badges ub JOIN users u ON u.id = ub.user_id")).all())
+        cells = {(discord_id, day, hour): count for discord_id, day, hour, count in conn.execute(text(
+            "SELECT u.discord_id, a.day_of_week, a.hour, a.message_count FROM activity_patterns a "
+            "JOIN users u ON u.id = a.user_id WHERE a.message_count != 0"))}
+    rows = standings.rows[:len(standings.index)]
+    in_memory = {int(row['discord_id']): {field: row[field].item() for field in STANDINGS_FIELDS}
+                 for row in rows}
+    return users, earned, cells, in_memory
+
+def diff(seed: int, expected, actual) -> list:
+    expected_users, expected_badges, expected_cells = expected
+    users, badges, cells, in_memory = actual
+    problems = []
+    for discord_id in sorted(set(expected_users) | set(users)):
+        want, got = expected_users.get(discord_id), users.get(discord_id)
+        if want is None or got is None:
+            problems.append(f"seed {seed} user {discord_id}: expected {want}, stored {got}")
+            continue
+        for field in USER_FIELDS:
+            equal = (abs(want[field] - got[field]) < 1e-9 if field == 'score' else want[field] == got[field])
+            if not equal:
+                problems.append(f"seed {seed} user {discord_id} {field}: expected {want[field]}, stored {got[field]}")
+        memory = in_memory.get(discord_id)
+        for field in STANDINGS_FIELDS:
+            if memory is None or abs(memory[field] - got[field]) > 1e-9:
+                problems.append(f"seed {seed} user {discord_id} standings {field}: "
+                                f"stored {got[field]}, in memory {memory and memory[field]}")
+    for discord_id, badge_id in sorted(expected_badges ^ badges):
+        state = 'missing' if (discord_id, badge_id) in expected_badges else 'unexpected'
+        problems.append(f"seed {seed} user {discord_id}: {state} badge {badge_id}")
+    for cell in sorted(set(expected_cells) | set(cells)):
+        if expected_cells.get(cell, 0) != cells.get(cell, 0):
+            problems.append(f"seed {seed} activity cell {cell}: expected {expected_cells.get(cell, 0)}, "
+                            f"stored {cells.get(cell, 0)}")
+    return problems
+
+def season_rows(season_id: int) -> dict:
+    with engine.connect() as conn:
+        return {row.discord_id: tuple(row)[1:] for row in conn.execute(text(
+            f"SELECT discord_id, {', '.join(USER_FIELDS)} FROM users WHERE season_id = :season_id"
+        ), {'season_id': season_id})}
+
+def ended_season_checks() -> list:
+    """Engagement and deletes that concern an ended season's messages must leave its standings alone."""
+    reset_database()
+    earlier = datetime.utcnow() - timedelta(hours=2)
+    store_message(1, 100, 7, earlier)
+    store_message(2, 200, 7, earlier, 1)
+    engagement_tracker.add_reaction(1, 300)
+    engagement_tracker.flush()
+    ended_id = current_season().id
+    before = season_rows(ended_id)
+
+    time.sleep(0.01)
+    start_new_season()
+    standings.reset(current_season().id)
+    store_message(3, 200, 7, datetime.utcnow(), 1)
+    store_message(4, 100, 8, datetime.utcnow())
+    engagement_tracker.add_reaction(1, 400)
+    engagement_tracker.add_reaction(2, 400)
+    engagement_tracker.add_reaction(4, 200)
+    engagement_tracker.flush()
+    delete_messages([2])
+    run_job(delete_channel_messages([7]))
+
+    problems = []
+    after = season_rows(ended_id)
+    for discord_id in sorted(set(before) | set(after)):
+        if before.get(discord_id) != after.get(discord_id):
+            problems.append(f"ended season user {discord_id}: {before.get(discord_id)} became {after.get(discord_id)}")
+    current = {discord_id: dict(zip(USER_FIELDS, row)) for discord_id, row in season_rows(current_season().id).items()}
+    for discord_id, field, want in ((100, 'total_messages', 1), (100, 'reactions_received', 1),
+                                    (200, 'total_messages', 0), (200, 'replies_received', 0)):
+        got = current.get(discord_id, {}).get(field)
+        if got != want:
+            problems.append(f"current season user {discord_id}: {field} expected {want}, stored {got}")
+    with engine.connect() as conn:
+        kept = conn.execute(text("SELECT COUNT(*) FROM messages WHERE discord_message_id IN (1, 2)")).scalar()
+    if kept != 2:
+        problems.append(f"ended season messages: expected 2 kept, {kept} left")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seeds', type=int, default=3, help='number of streams to replay')
+    parser.add_argument('--first-seed', type=int, default=36)
+    parser.add_argument('--messages', type=int, default=2_000, help='distinct messages per stream')
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--days', type=int, default=45, help='days of history per stream')
+    args = parser.parse_args()
+
+    session = Session()
+    badges = [(badge.id, badge.name, badge.requirement_type, badge.requirement_value)
+              for badge in session.query(Badge).order_by(Badge.id)]
+    session.close()
+
+    problems = []
+    live_time = reference_time = 0.0
+    event_count = 0
+    for seed in range(args.first_seed, args.first_seed + args.seeds):
+        events = synthetic_events(seed, args.messages, args.users, args.days)
+        event_count += len(events)
+        reset_database()
+
+        start = time.perf_counter()
+        replay_live(events)
+        live_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        expected = reference_recompute(events, badges)
+        reference_time += time.perf_counter() - start
+
+        seed_problems = diff(seed, expected, live_state())
+        print(f"seed {seed}: {len(events)} events, {len(expected[0])} users, "
+              f"{len(expected[1])} badges, {len(seed_problems)} differences")
+        problems.extend(seed_problems)
+
+    season_problems = ended_season_checks()
+    print(f"ended season: {len(season_problems)} differences")
+    problems.extend(season_problems)
+
+    messages = args.seeds * args.messages
+    print(f"live incremental path: {live_time:8.2f} s ({messages / live_time:9.0f} msg/s, "
+          f"{event_count / live_time:9.0f} events/s)")
+    print(f"reference recompute:   {reference_time:8.2f} s ({messages / reference_time:9.0f} msg/s)")
+    for problem in problems[:50]:
+        print(problem)
+    if len(problems) > 50:
+        print(f"... and {len(problems) - 50} more")
+    sys.exit(1 if problems else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Load test: ``!lb`` latency while a large backfill runs through the work scheduler.
+
+Feeds synthetic message history through the same batched backfill job the bot
+uses, while a simulated user issues the leaderboard query in the interactive
+lane every ``--interval`` seconds. Reports leaderboard latency percentiles and
+backfill throughput. ``--baseline`` runs the backfill inline on the event loop
+instead, which is how ingestion worked before the scheduler existed.
+
+Usage: python benchmarks/load_scheduler_backfill.py [--messages 1000000] [--users 5000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+# Point the models at a throwaway database before they are imported
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import BACKFILL_BATCH_SIZE  # noqa: E402
+from scheduler import WorkScheduler  # noqa: E402
+from utils import store_message_batch, load_leaderboard_users  # noqa: E402
+
+def synthetic_history(count: int, users: int, seed: int):
+    """Yield (message_id, author_id, channel_id, timestamp) records, newest first like channel.history()."""
+    rng = random.Random(seed)
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    for idx in range(count, 0, -1):
+        yield (10 ** 17 + idx, 10 ** 16 + rng.randrange(users), 10 ** 15 + rng.randrange(7),
+               start + timedelta(seconds=idx * 20))
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+async def run(args):
+    scheduler = WorkScheduler()
+    latencies = []
+    done = asyncio.Event()
+
+    async def leaderboard_client():
+        # Requests arrive on a fixed schedule; latency counts from the scheduled
+        # arrival, so time spent waiting for a blocked event loop is included.
+        arrival = time.perf_counter()
+        while not done.is_set():
+            await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+            if args.baseline:
+                load_leaderboard_users()
+            else:
+                await scheduler.run_interactive(load_leaderboard_users)
+            latencies.append(time.perf_counter() - arrival)
+            arrival = max(arrival + args.interval, time.perf_counter())
+
+    async def backfill():
+        new_messages = 0
+        records = synthetic_history(args.messages, args.users, args.seed)
+        while True:
+            batch = [record for _, record in zip(range(BACKFILL_BATCH_SIZE), records)]
+            if not batch:
+                break
+            if args.baseline:
+                # Old behaviour: the whole batch is ingested on the event loop
+                for _ in store_message_batch(batch):
+                    pass
+                new_messages += len(batch)
+                await asyncio.sleep(0)
+            else:
+                new_messages += await scheduler.run_sliced(store_message_batch(batch), name='backfill')
+        done.set()
+        return new_messages
+
+    client = asyncio.create_task(leaderboard_client())
+    start = time.perf_counter()
+    new_messages = await backfill()
+    elapsed = time.perf_counter() - start
+    await client
+    await scheduler.stop()
+
+    mode = 'inline (baseline)' if args.baseline else 'scheduler'
+    print(f"mode: {mode}")
+    print(f"backfill: {new_messages} messages in {elapsed:.1f}s ({new_messages / elapsed:.0f} msg/s)")
+    print(f"!lb queries: {len(latencies)} | "
+          f"p50 {percentile(latencies, 0.50) * 1000:.1f} ms | "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms | "
+          f"max {max(latencies) * 1000:.1f} ms")
+    if not args.baseline:
+        print(f"scheduler: {scheduler.stats()}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=5_000)
+    parser.add_argument('--interval', type=float, default=0.1, help='Seconds between !lb calls')
+    parser.add_argument('--seed', type=int, default=28)
+    parser.add_argument('--baseline', action='store_true', help='Ingest on the event loop, without the scheduler')
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
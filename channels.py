@@ -0,0 +1,82 @@
+from typing import Iterable, Optional, Set, Tuple
+import logging
+import discord
+from config import TRACKED_CATEGORY_ID, EXCLUDED_CHANNEL_ID, TRACKED_CHANNEL_IDS
+
+logger = logging.getLogger('LeaderboardBot')
+
+ADDED = 'added'
+REMOVED = 'removed'
+
+class TrackedChannels:
+    """The set of channel IDs whose messages are counted.
+
+    A text channel is tracked when it sits in the tracked category and is not the
+    excluded channel, or when it is listed in ``TRACKED_CHANNEL_IDS``. The set is
+    built from the guild cache at startup and kept current from channel events,
+    so membership checks never touch Discord or the database.
+    """
+    def __init__(self, category_id: int = TRACKED_CATEGORY_ID, excluded_ids: Iterable[int] = (EXCLUDED_CHANNEL_ID,),
+                 extra_ids: Iterable[int] = TRACKED_CHANNEL_IDS):
+        self.category_id = category_id
+        self.excluded_ids = set(excluded_ids)
+        self.extra_ids = set(extra_ids)
+        self.ids: Set[int] = set()
+        # Whether the last refresh saw every guild; only then is a missing channel really gone
+        self.complete = False
+
+    def __contains__(self, channel_id: int) -> bool:
+        return channel_id in self.ids
+
+    def __iter__(self):
+        return iter(sorted(self.ids))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def should_track(self, channel) -> bool:
+        """Whether a channel's messages should be counted."""
+        if not isinstance(channel, discord.TextChannel) or channel.id in self.excluded_ids:
+            return False
+        return channel.category_id == self.category_id or channel.id in self.extra_ids
+
+    def refresh(self, guilds: Iterable[discord.Guild]) -> Tuple[Set[int], Set[int]]:
+        """Rebuild the set from the guild cache; returns the (added, removed) channel IDs.
+
+        An unavailable guild has no channels in the cache, so while any guild is
+        unavailable channels are only added, never removed.
+        """
+        guilds = list(guilds)
+        ids = {channel.id for guild in guilds for channel in guild.text_channels if self.should_track(channel)}
+        unavailable = [guild.id for guild in guilds if guild.unavailable]
+        self.complete = not unavailable
+        if unavailable:
+            logger.warning(f"Guilds {unavailable} are unavailable; keeping their previously tracked channels")
+            ids |= self.ids
+        added, removed = ids - self.ids, self.ids - ids
+        self.ids = ids
+        logger.info(f"Tracking {len(ids)} channels")
+        return added, removed
+
+    def update(self, channel) -> Optional[str]:
+        """Re-evaluate a created or updated channel; returns ADDED, REMOVED or None."""
+        tracked = self.should_track(channel)
+        if tracked and channel.id not in self.ids:
+            self.ids.add(channel.id)
+            logger.info(f"Now tracking channel {channel.name} ({channel.id})")
+            return ADDED
+        if not tracked and channel.id in self.ids:
+            self.ids.discard(channel.id)
+            logger.info(f"Stopped tracking channel {channel.name} ({channel.id})")
+            return REMOVED
+        return None
+
+    def discard(self, channel_id: int) -> bool:
+        """Forget a deleted channel; returns True if it was tracked."""
+        if channel_id in self.ids:
+            self.ids.discard(channel_id)
+            return True
+        return False
+
+# Shared tracked channel set used by the bot
+tracked_channels = TrackedChannels()
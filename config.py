@@ -12,7 +12,7 @@ TRACKED_CATEGORY_ID = int(os.getenv('TRACKED_CATEGORY_ID', '1311716522858778736'
 EXCLUDED_CHANNEL_ID = int(os.getenv('EXCLUDED_CHANNEL_ID', '1313777896996732960'))
 ADMIN_IDS = [int(id.strip()) for id in os.getenv('ADMIN_IDS', '1015740711020281906').split(',')]
 
-# Tracked channels
+# Extra channels tracked outside TRACKED_CATEGORY_ID; text channels in the category are tracked automatically
 TRACKED_CHANNEL_IDS = {
     int(id.strip())
     for id in os.getenv('TRACKED_CHANNEL_IDS', '1312211055405170758,1312211208190824519,'
@@ -26,6 +26,10 @@ EARLY_BIRD_HOURS = set(range(5, 9))  # 5 AM to 9 AM
 
 # Database settings
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///leaderboard.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))  # Connection pool settings, unused with SQLite
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))  # Seconds before a connection is replaced
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
 
 # Cache settings
 CACHE_DURATION = int(os.getenv('CACHE_DURATION', '300'))  # 5 minutes in seconds
@@ -37,4 +41,49 @@ MESSAGE_FETCH_INTERVAL = int(os.getenv('MESSAGE_FETCH_INTERVAL', '900'))  # 15 m
 
 # Rate limiting
 COMMAND_RATE_LIMIT = int(os.getenv('COMMAND_RATE_LIMIT', '5'))  # Commands per minute
-BACKUP_INTERVAL = int(os.getenv('BACKUP_INTERVAL', '86400'))  # 24 hours in seconds 
\ No newline at end of file
+BACKUP_INTERVAL = int(os.getenv('BACKUP_INTERVAL', '86400'))  # 24 hours in seconds
+
+# Work scheduler
+SCHEDULER_SLICE_MS = int(os.getenv('SCHEDULER_SLICE_MS', '50'))  # Max time a background job holds the worker
+INTERACTIVE_LATENCY_TARGET_MS = int(os.getenv('INTERACTIVE_LATENCY_TARGET_MS', '200'))
+BACKFILL_BATCH_SIZE = int(os.getenv('BACKFILL_BATCH_SIZE', '500'))  # Messages fetched before handing off to the DB
+BACKFILL_CHUNK_SIZE = int(os.getenv('BACKFILL_CHUNK_SIZE', '10'))  # Messages committed per slice step
+DELETE_BATCH_SIZE = int(os.getenv('DELETE_BATCH_SIZE', '200'))  # Messages uncounted per slice step when a channel is dropped
+
+# Logging
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))  # Rotate at 10 MB
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # Log file format: json or text
+LOG_RATE_LIMIT = int(os.getenv('LOG_RATE_LIMIT', '20'))  # Debug/info records per call site per period, 0 to disable; warnings and errors always pass
+LOG_RATE_PERIOD = int(os.getenv('LOG_RATE_PERIOD', '60'))  # Seconds
+
+# Seasons
+SEASONS_KEEP_MESSAGES = int(os.getenv('SEASONS_KEEP_MESSAGES', '1'))  # Ended seasons that keep per-message rows
+SEASON_COMPACT_BATCH_SIZE = int(os.getenv('SEASON_COMPACT_BATCH_SIZE', '1000'))
+
+# Engagement scoring
+SCORE_WEIGHT_MESSAGES = float(os.getenv('SCORE_WEIGHT_MESSAGES', '1.0'))
+SCORE_WEIGHT_REPLIES = float(os.getenv('SCORE_WEIGHT_REPLIES', '3.0'))  # Per reply from another user
+SCORE_WEIGHT_REACTIONS = float(os.getenv('SCORE_WEIGHT_REACTIONS', '1.0'))  # Per reaction from another user
+LEADERBOARD_SORT = os.getenv('LEADERBOARD_SORT', 'score')  # Rank by score or messages
+ENGAGEMENT_FLUSH_INTERVAL = int(os.getenv('ENGAGEMENT_FLUSH_INTERVAL', '10'))  # Seconds between counter flushes
+
+# Outbound Discord API queue
+OUTBOUND_ROUTE_BURST = int(os.getenv('OUTBOUND_ROUTE_BURST', '5'))  # Calls a route may make back to back
+OUTBOUND_ROUTE_RATE = float(os.getenv('OUTBOUND_ROUTE_RATE', '1.0'))  # Calls per second per route after a burst
+OUTBOUND_REACTION_RATE = float(os.getenv('OUTBOUND_REACTION_RATE', '4.0'))  # Reaction calls per second per channel
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '40'))  # Calls per second across all routes
+
+# JSON API for dashboards
+API_ENABLED = os.getenv('API_ENABLED', 'false').lower() == 'true'
+API_HOST = os.getenv('API_HOST', '127.0.0.1')
+API_PORT = int(os.getenv('API_PORT', '8080'))
+API_RATE_LIMIT = int(os.getenv('API_RATE_LIMIT', '60'))  # Requests per client per period
+API_RATE_PERIOD = int(os.getenv('API_RATE_PERIOD', '60'))  # Seconds
+API_PAGE_SIZE = int(os.getenv('API_PAGE_SIZE', '25'))  # Default entries per page, at most 100
+
+# Warm-restart snapshot
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', 'state.snapshot')
+SNAPSHOT_INTERVAL = int(os.getenv('SNAPSHOT_INTERVAL', '900'))  # Seconds between periodic snapshots
@@ -0,0 +1,182 @@
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Set, Tuple
+import logging
+import threading
+from sqlalchemy import bindparam, func, or_, select, update
+from models import Session, User, Message
+from seasons import current_season
+from standings import standings
+from config import SCORE_WEIGHT_MESSAGES, SCORE_WEIGHT_REPLIES, SCORE_WEIGHT_REACTIONS, LEADERBOARD_SORT
+
+logger = logging.getLogger('LeaderboardBot')
+
+# SQLite limits the number of bound parameters per statement
+LOOKUP_CHUNK_SIZE = 500
+
+users = User.__table__
+messages = Message.__table__
+
+def engagement_score(total_messages, replies_received, reactions_received):
+    """Weighted engagement score used for ranking; works on numbers and SQL expressions alike."""
+    return (SCORE_WEIGHT_MESSAGES * total_messages +
+            SCORE_WEIGHT_REPLIES * replies_received +
+            SCORE_WEIGHT_REACTIONS * reactions_received)
+
+def ranking_column():
+    """Column the leaderboard is ordered by."""
+    return User.score if LEADERBOARD_SORT == 'score' else User.total_messages
+
+def recompute_scores():
+    """Recompute every stored score, e.g. after the weights were changed."""
+    session = Session()
+    try:
+        score = engagement_score(users.c.total_messages, users.c.replies_received, users.c.reactions_received)
+        # Only rows whose score changes are written, so unchanged weights leave the database as it was
+        session.execute(update(users).where(or_(users.c.score.is_(None), users.c.score != score)).values(score=score))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def _chunks(values: List, size: int = LOOKUP_CHUNK_SIZE) -> Iterable[List]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+class EngagementTracker:
+    """Collects engagement events and applies them to counters in batches.
+
+    Reactions are buffered as (message, reacting user) counts. Replies need no
+    buffer: each stored message records the message it replies to, and a flush
+    links newly stored messages to their parents (or children) with one grouped
+    lookup, so a reply is counted once whichever side is stored first. Each flush
+    issues a fixed handful of statements no matter how many events it covers.
+    Self-replies and self-reactions are not counted, and neither is engagement
+    with messages from ended seasons, whose standings are final.
+    """
+    def __init__(self):
+        self._reactions: Counter = Counter()
+        self._stored: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def add_reaction(self, message_id: int, reactor_id: int, delta: int = 1):
+        """Buffer a reaction added to (or, with a negative delta, removed from) a message."""
+        with self._lock:
+            self._reactions[(message_id, reactor_id)] += delta
+
+    def note_stored(self, message_ids: Iterable[int]):
+        """Remember newly stored messages so the next flush can link their replies."""
+        with self._lock:
+            self._stored.update(message_ids)
+
+    @property
+    def pending(self) -> int:
+        return len(self._reactions) + len(self._stored)
+
+    def flush(self) -> int:
+        """Apply buffered engagement in one transaction; returns the number of events applied."""
+        with self._lock:
+            reactions, self._reactions = self._reactions, Counter()
+            stored, self._stored = self._stored, set()
+        if not reactions and not stored:
+            return 0
+
+        session = Session()
+        try:
+            applied, user_ids = self._apply(session, reactions, stored)
+            session.commit()
+            standings.refresh_users(session, user_ids)
+            return applied
+        except Exception:
+            session.rollback()
+            # Put the events back so they are retried on the next flush
+            with self._lock:
+                self._reactions.update(reactions)
+                self._stored.update(stored)
+            raise
+        finally:
+            session.close()
+
+    def _apply(self, session: Session, reactions: Counter, stored: Set[int]) -> Tuple[int, List[int]]:
+        # Reply links touching a newly stored message, as (child, parent, child author)
+        links: Dict[int, Tuple[int, int]] = {}
+        stored_ids = list(stored)
+        for chunk in _chunks(stored_ids):
+            rows = session.execute(
+                select(messages.c.discord_message_id, messages.c.reply_to_id, users.c.discord_id)
+                .join(users, users.c.id == messages.c.user_id)
+                .where(messages.c.reply_to_id.is_not(None),
+                       or_(messages.c.discord_message_id.in_(chunk), messages.c.reply_to_id.in_(chunk)))
+            )
+            for child_id, parent_id, author_id in rows:
+                links[child_id] = (parent_id, author_id)
+
+        # Resolve every current-season target message to its author in one pass
+        targets = list({parent_id for parent_id, _ in links.values()} |
+                       {message_id for message_id, _ in reactions})
+        owners: Dict[int, Tuple[int, int]] = {}
+        season_id = current_season(session).id
+        for chunk in _chunks(targets):
+            rows = session.execute(
+                select(messages.c.discord_message_id, messages.c.user_id, users.c.discord_id)
+                .join(users, users.c.id == messages.c.user_id)
+                .where(users.c.season_id == season_id, messages.c.discord_message_id.in_(chunk))
+            )
+            for message_id, user_id, author_id in rows:
+                owners[message_id] = (user_id, author_id)
+
+        message_replies: Dict[int, int] = defaultdict(int)
+        message_reactions: Dict[int, int] = defaultdict(int)
+        user_replies: Dict[int, int] = defaultdict(int)
+        user_reactions: Dict[int, int] = defaultdict(int)
+
+        for parent_id, replier_id in links.values():
+            owner = owners.get(parent_id)
+            if owner and owner[1] != replier_id:
+                message_replies[parent_id] += 1
+                user_replies[owner[0]] += 1
+        for (message_id, reactor_id), delta in reactions.items():
+            owner = owners.get(message_id)
+            if owner and owner[1] != reactor_id and delta:
+                message_reactions[message_id] += delta
+                user_reactions[owner[0]] += delta
+
+        message_updates = [
+            {'b_message_id': message_id, 'b_replies': message_replies.get(message_id, 0),
+             'b_reactions': message_reactions.get(message_id, 0)}
+            for message_id in set(message_replies) | set(message_reactions)
+        ]
+        if message_updates:
+            session.execute(
+                update(messages).where(messages.c.discord_message_id == bindparam('b_message_id')).values(
+                    reply_count=func.coalesce(messages.c.reply_count, 0) + bindparam('b_replies'),
+                    reaction_count=func.coalesce(messages.c.reaction_count, 0) + bindparam('b_reactions'),
+                ),
+                message_updates
+            )
+
+        user_updates = [
+            {'b_user_id': user_id, 'b_replies': user_replies.get(user_id, 0),
+             'b_reactions': user_reactions.get(user_id, 0)}
+            for user_id in set(user_replies) | set(user_reactions)
+        ]
+        if user_updates:
+            # Every SET expression sees the old row, so the score is built from the new values
+            received = {
+                'replies_received': users.c.replies_received + bindparam('b_replies'),
+                'reactions_received': users.c.reactions_received + bindparam('b_reactions'),
+            }
+            session.execute(
+                update(users).where(users.c.id == bindparam('b_user_id')).values(
+                    score=engagement_score(users.c.total_messages, *received.values()),
+                    **received
+                ),
+                user_updates
+            )
+
+        applied = sum(message_replies.values()) + sum(abs(delta) for delta in message_reactions.values())
+        return applied, [user_update['b_user_id'] for user_update in user_updates]
+
+# Shared tracker used by the bot
+engagement_tracker = EngagementTracker()
@@ -1,18 +1,53 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float, ForeignKey, Table
+from sqlalchemy import (
+    create_engine, event, inspect, text, Column, Integer, BigInteger, String, DateTime, Float,
+    ForeignKey, Index, MetaData, Table
+)
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
 from datetime import datetime
-from config import DATABASE_URL
+from config import DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE
+
+DISCORD_EPOCH = datetime(2015, 1, 1)
+
+def _engine_options(url: str) -> dict:
+    """Connection pool settings for server databases; SQLite keeps SQLAlchemy's defaults."""
+    if make_url(url).get_backend_name() == 'sqlite':
+        return {}
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': True,
+    }
 
 Base = declarative_base()
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
 Session = sessionmaker(bind=engine)
 
+class Season(Base):
+    __tablename__ = 'seasons'
+    
+    id = Column(Integer, primary_key=True)
+    number = Column(Integer, unique=True)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    ended_at = Column(DateTime)  # NULL for the current season
+    archived_at = Column(DateTime)  # Set once per-message rows have been compacted away
+    
+    # Relationships
+    users = relationship("User", back_populates="season")
+
 class User(Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        Index('ix_users_season_discord', 'season_id', 'discord_id', unique=True),
+        Index('ix_users_season_score', 'season_id', 'score'),
+    )
     
     id = Column(Integer, primary_key=True)
-    discord_id = Column(String, unique=True)
+    season_id = Column(Integer, ForeignKey('seasons.id'))
+    discord_id = Column(BigInteger)
     total_messages = Column(Integer, default=0)
     streak = Column(Integer, default=0)
     best_streak = Column(Integer, default=0)
@@ -21,28 +56,40 @@ class User(Base):
     early_bird_messages = Column(Integer, default=0)
     weekend_messages = Column(Integer, default=0)
     weekday_messages = Column(Integer, default=0)
+    first_active_date = Column(DateTime)
+    replies_received = Column(Integer, default=0)  # Replies from other users to this user's messages
+    reactions_received = Column(Integer, default=0)  # Reactions from other users on this user's messages
+    score = Column(Float, default=0.0)  # Weighted engagement score, see engagement.engagement_score
     
     # Relationships
+    season = relationship("Season", back_populates="users")
     messages = relationship("Message", back_populates="user")
     activity_patterns = relationship("ActivityPattern", back_populates="user")
     badges = relationship("UserBadge", back_populates="user")
 
 class Message(Base):
     __tablename__ = 'messages'
+    __table_args__ = (
+        Index('ix_messages_channel', 'channel_id', 'discord_message_id'),
+    )
     
     id = Column(Integer, primary_key=True)
-    discord_message_id = Column(String, unique=True)
-    user_id = Column(Integer, ForeignKey('users.id'))
-    channel_id = Column(String)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    discord_message_id = Column(BigInteger, unique=True)
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
+    channel_id = Column(BigInteger)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
     reaction_count = Column(Integer, default=0)
     reply_count = Column(Integer, default=0)
+    reply_to_id = Column(BigInteger, index=True)  # Discord ID of the message this one replies to
     
     # Relationships
     user = relationship("User", back_populates="messages")
 
 class ActivityPattern(Base):
     __tablename__ = 'activity_patterns'
+    __table_args__ = (
+        Index('ix_activity_patterns_cell', 'user_id', 'day_of_week', 'hour', unique=True),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
@@ -53,6 +100,12 @@ class ActivityPattern(Base):
     # Relationships
     user = relationship("User", back_populates="activity_patterns")
 
+class ChannelCursor(Base):
+    __tablename__ = 'channel_cursors'
+    
+    channel_id = Column(BigInteger, primary_key=True)
+    last_message_id = Column(BigInteger)  # Newest message the history backfill has read
+
 class Badge(Base):
     __tablename__ = 'badges'
     
@@ -65,6 +118,9 @@ class Badge(Base):
 
 class UserBadge(Base):
     __tablename__ = 'user_badges'
+    __table_args__ = (
+        Index('ix_user_badges_user_badge', 'user_id', 'badge_id', unique=True),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
@@ -75,9 +131,226 @@ class UserBadge(Base):
     user = relationship("User", back_populates="badges")
     badge = relationship("Badge")
 
+class StateGeneration(Base):
+    __tablename__ = 'state_generation'
+    
+    id = Column(Integer, primary_key=True)
+    generation = Column(BigInteger, nullable=False, default=0)  # Bumped by every transaction that writes the stats tables
+
 # Create all tables
 Base.metadata.create_all(engine)
 
+# Tables the bot's in-memory state is derived from
+GENERATION_TABLES = {'seasons', 'users', 'messages', 'activity_patterns', 'badges', 'user_badges'}
+
+with engine.begin() as conn:
+    if conn.execute(text("SELECT COUNT(*) FROM state_generation")).scalar() == 0:
+        conn.execute(text("INSERT INTO state_generation (id, generation) VALUES (1, 0)"))
+
+def mark_state_changed(conn):
+    """Record that the connection's transaction changed the stats tables.
+
+    Insert, update and delete constructs are noticed on their own; raw SQL
+    writes to those tables must call this.
+    """
+    conn.info['state_changed'] = True
+
+@event.listens_for(engine, 'after_execute')
+def _note_state_write(conn, clauseelement, multiparams, params, execution_options, result):
+    if not isinstance(clauseelement, UpdateBase):
+        return
+    if getattr(clauseelement.table, 'name', None) not in GENERATION_TABLES:
+        return
+    # Without RETURNING a zero row count means nothing changed; with it, rows may not be fetched yet
+    if result.returns_rows or result.rowcount != 0:
+        mark_state_changed(conn)
+
+@event.listens_for(engine, 'commit')
+def _bump_state_generation(conn):
+    """Advance the state generation once in each transaction that changed the stats tables.
+
+    Snapshots record the generation they were written at, so any change made
+    since shows up as a different number.
+    """
+    if not conn.info.pop('state_changed', False):
+        return
+    # Runs just before the DBAPI commit, so the bump lands in the same transaction
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute("UPDATE state_generation SET generation = generation + 1 WHERE id = 1")
+    finally:
+        cursor.close()
+
+@event.listens_for(engine, 'rollback')
+def _forget_state_write(conn):
+    conn.info.pop('state_changed', None)
+
+def state_generation(conn) -> int:
+    """The current state generation; takes a Connection or a Session."""
+    return int(conn.execute(text("SELECT generation FROM state_generation WHERE id = 1")).scalar())
+
+# Discord snowflake columns that older databases stored as text
+SNOWFLAKE_COLUMNS = {
+    'users': ['discord_id'],
+    'messages': ['discord_message_id', 'channel_id'],
+}
+
+def _rebuild_sqlite_table(conn, table: Table, casts: dict):
+    """Recreate a SQLite table from its current model definition, copying rows across.
+
+    SQLite cannot change a column's type in place, so the table is copied into a
+    freshly created one and swapped in under the original name.
+    """
+    tmp_metadata = MetaData()
+    for other in Base.metadata.sorted_tables:
+        if other.name != table.name:
+            other.to_metadata(tmp_metadata)
+    new_table = table.to_metadata(tmp_metadata, name=f'{table.name}_new')
+    # The copy's indexes would be named after it; the model's are created once it is renamed
+    new_table.indexes.clear()
+    for index in inspect(conn).get_indexes(table.name):
+        conn.execute(text(f"DROP INDEX IF EXISTS {index['name']}"))
+    new_table.create(conn)
+
+    columns = [column.name for column in table.columns]
+    existing = {column['name'] for column in inspect(conn).get_columns(table.name)}
+    selected = [
+        casts.get(name, name) if name in existing else 'NULL'
+        for name in columns
+    ]
+    conn.execute(text(
+        f"INSERT INTO {new_table.name} ({', '.join(columns)}) "
+        f"SELECT {', '.join(selected)} FROM {table.name}"
+    ))
+    conn.execute(text(f"DROP TABLE {table.name}"))
+    conn.execute(text(f"ALTER TABLE {new_table.name} RENAME TO {table.name}"))
+    for index in table.indexes:
+        index.create(conn)
+
+def migrate_snowflake_columns():
+    """Convert Discord ID columns stored as text in older databases to 64-bit integers."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table_name, column_names in SNOWFLAKE_COLUMNS.items():
+            text_columns = [
+                column['name'] for column in inspector.get_columns(table_name)
+                if column['name'] in column_names and isinstance(column['type'], String)
+            ]
+            if not text_columns:
+                continue
+
+            if engine.dialect.name == 'sqlite':
+                casts = {name: f'CAST({name} AS INTEGER)' for name in text_columns}
+                _rebuild_sqlite_table(conn, Base.metadata.tables[table_name], casts)
+            else:
+                for name in text_columns:
+                    conn.execute(text(
+                        f"ALTER TABLE {table_name} ALTER COLUMN {name} "
+                        f"TYPE BIGINT USING {name}::bigint"
+                    ))
+
+def add_missing_columns():
+    """Add columns introduced after a database was created."""
+    inspector = inspect(engine)
+    added = set()
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                if column.default is not None and column.default.is_scalar:
+                    conn.execute(
+                        text(f"UPDATE {table.name} SET {column.name} = :value"),
+                        {'value': column.default.arg}
+                    )
+                added.add((table.name, column.name))
+        if added:
+            mark_state_changed(conn)
+
+        if ('users', 'first_active_date') in added:
+            first_seen = conn.execute(text(
+                "SELECT user_id, MIN(timestamp) FROM messages GROUP BY user_id"
+            )).fetchall()
+            if first_seen:
+                conn.execute(
+                    text("UPDATE users SET first_active_date = :first WHERE id = :user_id"),
+                    [{'user_id': user_id, 'first': first} for user_id, first in first_seen]
+                )
+
+        if ('users', 'reactions_received') in added:
+            # Reactions were already counted per message; replies were never recorded
+            received = conn.execute(text(
+                "SELECT user_id, SUM(reaction_count) FROM messages GROUP BY user_id"
+            )).fetchall()
+            if received:
+                conn.execute(
+                    text("UPDATE users SET reactions_received = :total WHERE id = :user_id"),
+                    [{'user_id': user_id, 'total': total or 0} for user_id, total in received]
+                )
+
+def migrate_season_scope():
+    """Scope users to seasons, assigning rows from before seasons existed to season 1."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT COUNT(*) FROM seasons")).scalar() == 0:
+            # The first season covers all history, back to the Discord epoch
+            conn.execute(
+                text("INSERT INTO seasons (number, started_at) VALUES (1, :started_at)"),
+                {'started_at': DISCORD_EPOCH}
+            )
+            mark_state_changed(conn)
+        first_season = conn.execute(text("SELECT MIN(id) FROM seasons")).scalar()
+        if conn.execute(
+            text("UPDATE users SET season_id = :season_id WHERE season_id IS NULL"),
+            {'season_id': first_season}
+        ).rowcount:
+            mark_state_changed(conn)
+        
+        # Discord IDs used to be unique across the whole table
+        global_unique = [
+            constraint for constraint in inspector.get_unique_constraints('users')
+            if constraint['column_names'] == ['discord_id']
+        ]
+        if not global_unique:
+            return
+        if engine.dialect.name == 'sqlite':
+            _rebuild_sqlite_table(conn, Base.metadata.tables['users'], {})
+        else:
+            for constraint in global_unique:
+                conn.execute(text(f"ALTER TABLE users DROP CONSTRAINT {constraint['name']}"))
+
+def dedupe_user_badges():
+    """Remove repeated badge awards so (user_id, badge_id) can be made unique."""
+    if any(index['name'] == 'ix_user_badges_user_badge' for index in inspect(engine).get_indexes('user_badges')):
+        return
+    with engine.begin() as conn:
+        if conn.execute(text(
+            "DELETE FROM user_badges WHERE id NOT IN "
+            "(SELECT MIN(id) FROM user_badges GROUP BY user_id, badge_id)"
+        )).rowcount:
+            mark_state_changed(conn)
+
+def create_missing_indexes():
+    """Create indexes that were added to the models after the tables existed."""
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            # Earlier table rebuilds left copies of the indexes named after the temporary table
+            for index in inspector.get_indexes(table.name):
+                if index['name'].startswith(f'ix_{table.name}_new_'):
+                    conn.execute(text(f"DROP INDEX IF EXISTS {index['name']}"))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+add_missing_columns()
+migrate_snowflake_columns()
+migrate_season_scope()
+dedupe_user_badges()
+create_missing_indexes()
+
 # Initialize default badges
 def init_default_badges():
     session = Session()
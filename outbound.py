@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Deque, Dict, Optional, Tuple
+import aiohttp
+import discord
+from config import OUTBOUND_ROUTE_BURST, OUTBOUND_ROUTE_RATE, OUTBOUND_REACTION_RATE, OUTBOUND_GLOBAL_RATE
+
+logger = logging.getLogger('LeaderboardBot')
+
+# Call kinds; with a channel ID they form a route, roughly how Discord buckets its limits
+SEND = 'send'
+EDIT = 'edit'
+DELETE = 'delete'
+REACTION = 'reaction'
+
+BULK_DELETE_MAX = 100
+BULK_DELETE_MAX_AGE = timedelta(days=14)
+
+_MESSAGE_PATH = re.compile(r'/channels/(\d+)/messages(?:/(\d+|bulk-delete))?(/reactions/.*)?$')
+
+def route_for(method: str, path: str) -> Optional[Tuple[str, int]]:
+    """Map a REST request to the queue route it counts against, if any."""
+    match = _MESSAGE_PATH.search(path)
+    if not match:
+        return None
+    channel_id, target, reactions = int(match.group(1)), match.group(2), match.group(3)
+    if reactions:
+        return REACTION, channel_id
+    if target == 'bulk-delete' or (target and method == 'DELETE'):
+        return DELETE, channel_id
+    if target and method == 'PATCH':
+        return EDIT, channel_id
+    if not target and method == 'POST':
+        return SEND, channel_id
+    return None
+
+class _Budget:
+    """Token bucket for one route, corrected from Discord's rate limit headers."""
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self) -> float:
+        """Take a token and return 0, or return how long to wait for one."""
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def observe(self, remaining: int, reset_after: float):
+        """Trust Discord's view of the bucket over our estimate."""
+        self.tokens = min(self.tokens, remaining)
+        if remaining <= 0:
+            self.block(reset_after)
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class _Call:
+    """A queued REST call and the future its caller awaits."""
+    __slots__ = ('kind', 'target', 'args', 'kwargs', 'future')
+
+    def __init__(self, kind: str, target: Any, args: tuple, kwargs: dict, future: asyncio.Future):
+        self.kind = kind
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+
+class OutboundQueue:
+    """Send outgoing Discord REST calls through per-route budgets.
+
+    Calls are queued per route (a kind of call in one channel) and each route
+    drains at the pace its token bucket allows, under a global budget, so bursts
+    are spread out instead of running into 429s. While an edit is still queued,
+    later edits of the same message replace its content, so only the newest embed
+    is sent. Queued deletes in one channel go out as bulk deletes. Every method
+    returns a future; callers may await it or leave it, and failures are logged
+    either way.
+    """
+    def __init__(self, burst: int = OUTBOUND_ROUTE_BURST, rate: float = OUTBOUND_ROUTE_RATE,
+                 reaction_rate: float = OUTBOUND_REACTION_RATE, global_rate: float = OUTBOUND_GLOBAL_RATE):
+        self.burst = burst
+        self.rate = rate
+        self.reaction_rate = reaction_rate
+        self._global = _Budget(global_rate, global_rate)
+        self._budgets: Dict[Tuple[str, int], _Budget] = {}
+        self._queues: Dict[Tuple[str, int], Deque[_Call]] = {}
+        self._workers: Dict[Tuple[str, int], asyncio.Task] = {}
+        self._pending_edits: Dict[int, _Call] = {}
+        self._requested = 0
+        self._calls = 0
+        self._coalesced = 0
+        self._bulk_saved = 0
+        self._throttled_seconds = 0.0
+        self._rate_limited = 0
+        self._rate_limited_seconds = 0.0
+        self._errors = 0
+
+    def _budget(self, route: Tuple[str, int]) -> _Budget:
+        if route not in self._budgets:
+            if route[0] == REACTION:
+                self._budgets[route] = _Budget(1, self.reaction_rate)
+            else:
+                self._budgets[route] = _Budget(self.burst, self.rate)
+        return self._budgets[route]
+
+    def _enqueue(self, kind: str, channel_id: int, target: Any, *args, **kwargs) -> asyncio.Future:
+        self._requested += 1
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(self._log_failure)
+        call = _Call(kind, target, args, kwargs, future)
+        route = (kind, channel_id)
+        self._queues.setdefault(route, deque()).append(call)
+        if route not in self._workers:
+            self._workers[route] = asyncio.get_running_loop().create_task(self._drain(route))
+        return call.future
+
+    def _log_failure(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            self._errors += 1
+            logger.warning(f"Discord API call failed: {str(future.exception())}")
+
+    def send(self, channel: discord.abc.Messageable, **kwargs) -> asyncio.Future:
+        """Send a message; the future resolves to the sent message."""
+        return self._enqueue(SEND, channel.id, channel, **kwargs)
+
+    def edit(self, message: discord.Message, **kwargs) -> asyncio.Future:
+        """Edit a message, folding into an edit of it that is still queued."""
+        pending = self._pending_edits.get(message.id)
+        if pending is not None:
+            pending.kwargs.update(kwargs)
+            self._requested += 1
+            self._coalesced += 1
+            return pending.future
+        future = self._enqueue(EDIT, message.channel.id, message, **kwargs)
+        self._pending_edits[message.id] = self._queues[(EDIT, message.channel.id)][-1]
+        return future
+
+    def delete(self, message: discord.Message) -> asyncio.Future:
+        """Delete a message; a message that is already gone counts as deleted."""
+        return self._enqueue(DELETE, message.channel.id, message)
+
+    async def delete_messages(self, messages) -> int:
+        """Delete several messages, in bulk where possible; returns how many deletes failed."""
+        results = await asyncio.gather(*(self.delete(message) for message in messages), return_exceptions=True)
+        return sum(isinstance(result, Exception) for result in results)
+
+    def add_reaction(self, message: discord.Message, emoji) -> asyncio.Future:
+        return self._enqueue(REACTION, message.channel.id, message, emoji)
+
+    def remove_reaction(self, message: discord.Message, emoji, member) -> asyncio.Future:
+        return self._enqueue(REACTION, message.channel.id, message, emoji, member)
+
+    async def _acquire(self, budget: _Budget):
+        for bucket in (budget, self._global):
+            while (wait := bucket.reserve()) > 0:
+                self._throttled_seconds += wait
+                await asyncio.sleep(wait)
+
+    async def _drain(self, route: Tuple[str, int]):
+        queue = self._queues[route]
+        budget = self._budget(route)
+        try:
+            while queue:
+                await self._acquire(budget)
+                if not queue:
+                    break
+                calls = [queue.popleft()]
+                if route[0] == EDIT:
+                    self._pending_edits.pop(calls[0].target.id, None)
+                elif route[0] == DELETE:
+                    calls = self._bulk_batch(calls[0], queue)
+                calls = [call for call in calls if not call.future.done()]
+                if not calls:
+                    continue
+                try:
+                    result = await self._perform(route[0], calls)
+                except discord.RateLimited as e:
+                    # Discord wants a longer pause than discord.py waits out; retry after it
+                    budget.block(e.retry_after)
+                    queue.extendleft(reversed(calls))
+                    if route[0] == EDIT:
+                        self._pending_edits.setdefault(calls[0].target.id, calls[0])
+                    continue
+                except Exception as e:
+                    for call in calls:
+                        if not call.future.done():
+                            call.future.set_exception(e)
+                    continue
+                for call in calls:
+                    if not call.future.done():
+                        call.future.set_result(result)
+        finally:
+            del self._workers[route]
+
+    def _bulk_batch(self, first: _Call, queue: Deque[_Call]) -> list:
+        """Take queued deletes that can share a bulk delete with the first one."""
+        if not self._bulk_eligible(first.target):
+            return [first]
+        calls, kept = [first], deque()
+        seen = {first.target.id}
+        while queue and len(calls) < BULK_DELETE_MAX:
+            call = queue.popleft()
+            if call.target.id in seen:
+                # Deleting the same message twice only needs one call
+                self._bulk_saved += 1
+                calls.append(call)
+            elif self._bulk_eligible(call.target):
+                seen.add(call.target.id)
+                calls.append(call)
+            else:
+                kept.append(call)
+        queue.extendleft(reversed(kept))
+        return calls
+
+    @staticmethod
+    def _bulk_eligible(message) -> bool:
+        # Discord rejects bulk deletes of messages older than 14 days
+        age = datetime.now(timezone.utc) - discord.utils.snowflake_time(message.id)
+        return age < BULK_DELETE_MAX_AGE - timedelta(minutes=1)
+
+    async def _perform(self, kind: str, calls: list):
+        call = calls[0]
+        if kind == SEND:
+            self._calls += 1
+            return await call.target.send(*call.args, **call.kwargs)
+        if kind == EDIT:
+            self._calls += 1
+            return await call.target.edit(*call.args, **call.kwargs)
+        if kind == REACTION:
+            self._calls += 1
+            if len(call.args) > 1:
+                return await call.target.remove_reaction(*call.args)
+            return await call.target.add_reaction(*call.args)
+
+        messages = list({call.target.id: call.target for call in calls}.values())
+        if len(messages) == 1:
+            self._calls += 1
+            try:
+                await messages[0].delete()
+            except discord.NotFound:
+                pass
+            return None
+        try:
+            self._calls += 1
+            await call.target.channel.delete_messages(messages)
+            self._bulk_saved += len(messages) - 1
+        except discord.RateLimited:
+            raise
+        except discord.HTTPException as e:
+            # Fall back to single deletes, e.g. when one of the messages is already gone
+            logger.warning(f"Bulk delete of {len(messages)} messages failed, deleting one by one: {str(e)}")
+            for message in messages:
+                await self._acquire(self._budget((DELETE, message.channel.id)))
+                self._calls += 1
+                try:
+                    await message.delete()
+                except discord.NotFound:
+                    pass
+        return None
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """aiohttp hook that feeds Discord's rate limit headers and 429s back into the budgets."""
+        trace = aiohttp.TraceConfig()
+        trace.on_request_end.append(self._on_request_end)
+        return trace
+
+    async def _on_request_end(self, session, context, params):
+        headers = params.response.headers
+        route = route_for(params.method, params.url.path)
+        if params.response.status == 429:
+            retry_after = float(headers.get('Retry-After', 0) or 0)
+            self._rate_limited += 1
+            self._rate_limited_seconds += retry_after
+            logger.warning(f"Rate limited on {params.method} {params.url.path} for {retry_after:.2f}s"
+                           + (" (global)" if headers.get('X-RateLimit-Global') else ""))
+            if headers.get('X-RateLimit-Global'):
+                self._global.block(retry_after)
+            elif route:
+                self._budget(route).block(retry_after)
+        elif route and 'X-RateLimit-Remaining' in headers:
+            self._budget(route).observe(int(headers['X-RateLimit-Remaining']),
+                                        float(headers.get('X-RateLimit-Reset-After', 0) or 0))
+
+    def stats(self) -> Dict[str, float]:
+        """Calls requested and made, what coalescing saved, and time spent held back."""
+        return {
+            'requested': self._requested,
+            'calls': self._calls,
+            'saved': self._coalesced + self._bulk_saved,
+            'coalesced_edits': self._coalesced,
+            'bulk_delete_saved': self._bulk_saved,
+            'queued': sum(len(queue) for queue in self._queues.values()),
+            'throttled_s': self._throttled_seconds,
+            'rate_limited': self._rate_limited,
+            'rate_limited_s': self._rate_limited_seconds,
+            'errors': self._errors,
+        }
+
+# Shared outbound queue used by the bot
+outbound = OutboundQueue()
@@ -0,0 +1,186 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Generator, Optional
+from config import SCHEDULER_SLICE_MS, INTERACTIVE_LATENCY_TARGET_MS
+
+logger = logging.getLogger('LeaderboardBot')
+
+# Lanes, in priority order
+INTERACTIVE = 0  # Commands and pagination a user is waiting on
+NORMAL = 1       # Live ingestion and periodic posts
+BACKGROUND = 2   # Backfill, rebuilds, exports and backups
+
+LANE_NAMES = {INTERACTIVE: 'interactive', NORMAL: 'normal', BACKGROUND: 'background'}
+
+class _Job:
+    """A unit of work waiting in the scheduler queue."""
+    def __init__(self, lane: int, name: str, future: asyncio.Future,
+                 func: Optional[Callable] = None, generator: Optional[Generator] = None):
+        self.lane = lane
+        self.name = name
+        self.future = future
+        self.func = func
+        self.generator = generator
+        self.submitted_at = time.perf_counter()
+        self.queued_at = self.submitted_at
+        self.started = False
+
+class WorkScheduler:
+    """Run blocking database work off the event loop, with interactive work first.
+
+    Every job executes on one worker thread, so database access is serialized and
+    never blocks the event loop. Heavy jobs are generators that are stepped in
+    bounded time slices and requeued between slices, which lets interactive jobs
+    cut in with a wait of at most one slice.
+    """
+    def __init__(self, slice_seconds: float = SCHEDULER_SLICE_MS / 1000,
+                 latency_target: float = INTERACTIVE_LATENCY_TARGET_MS / 1000):
+        self.slice_seconds = slice_seconds
+        self.latency_target = latency_target
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scheduler')
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._current: Optional[_Job] = None
+        self._sequence = itertools.count()
+        self._depth = {lane: 0 for lane in LANE_NAMES}
+        self._waits = {lane: deque(maxlen=1000) for lane in LANE_NAMES}
+        self._completed = {lane: 0 for lane in LANE_NAMES}
+        self._slices = 0
+        self._target_misses = 0
+
+    def start(self):
+        """Start the worker task on the running event loop."""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.PriorityQueue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the worker task and cancel the running and queued jobs.
+
+        Whoever awaits a cancelled job gets CancelledError. Queued generator jobs
+        are closed; the slice already on the worker thread still runs to its end.
+        """
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._current is not None:
+            self._current.future.cancel()
+            self._current = None
+        while self._queue is not None and not self._queue.empty():
+            _, _, job = self._queue.get_nowait()
+            self._depth[job.lane] -= 1
+            job.future.cancel()
+            if job.generator:
+                job.generator.close()
+
+    def shutdown(self):
+        """Wait for the job on the worker thread to finish; call once the event loop has stopped."""
+        self._executor.shutdown(wait=True)
+
+    def _enqueue(self, job: _Job):
+        job.queued_at = time.perf_counter()
+        self._depth[job.lane] += 1
+        self._queue.put_nowait((job.lane, next(self._sequence), job))
+
+    async def submit(self, func: Callable, *args, lane: int = NORMAL, name: Optional[str] = None, **kwargs) -> Any:
+        """Run a blocking callable on the worker thread and return its result."""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(_Job(lane, name or func.__name__, future, func=partial(func, *args, **kwargs)))
+        return await future
+
+    async def run_interactive(self, func: Callable, *args, **kwargs) -> Any:
+        """Run a blocking callable in the interactive lane."""
+        return await self.submit(func, *args, lane=INTERACTIVE, **kwargs)
+
+    async def run_sliced(self, generator: Generator, lane: int = BACKGROUND,
+                         name: str = 'background') -> Any:
+        """Step a generator job in bounded slices and return its ``return`` value.
+
+        The generator should yield after each small, committed unit of work; it is
+        paused at the first yield past the slice budget or whenever an interactive
+        job is waiting.
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(_Job(lane, name, future, generator=generator))
+        return await future
+
+    def _step(self, generator: Generator):
+        """Advance a generator for one slice on the worker thread."""
+        deadline = time.perf_counter() + self.slice_seconds
+        try:
+            while True:
+                next(generator)
+                if time.perf_counter() >= deadline or self._depth[INTERACTIVE] > 0:
+                    return False, None
+        except StopIteration as stop:
+            return True, stop.value
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, job = await self._queue.get()
+            self._depth[job.lane] -= 1
+
+            if job.future.cancelled():
+                if job.generator:
+                    job.generator.close()
+                continue
+
+            if not job.started:
+                job.started = True
+                wait = time.perf_counter() - job.submitted_at
+                self._waits[job.lane].append(wait)
+                if job.lane == INTERACTIVE and wait > self.latency_target:
+                    self._target_misses += 1
+                    logger.warning(f"Interactive job {job.name} waited {wait * 1000:.0f} ms "
+                                   f"(target {self.latency_target * 1000:.0f} ms)")
+
+            # Left set if the worker is cancelled mid-job, so stop() can cancel the job too
+            self._current = job
+            try:
+                if job.generator:
+                    self._slices += 1
+                    done, result = await loop.run_in_executor(self._executor, self._step, job.generator)
+                    if not done:
+                        self._current = None
+                        self._enqueue(job)
+                        continue
+                else:
+                    result = await loop.run_in_executor(self._executor, job.func)
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+            self._current = None
+            self._completed[job.lane] += 1
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Return queue depth and wait-time percentiles (in ms) per lane."""
+        stats = {}
+        for lane, name in LANE_NAMES.items():
+            waits = sorted(self._waits[lane])
+            stats[name] = {
+                'depth': self._depth[lane],
+                'completed': self._completed[lane],
+                'p50_ms': waits[len(waits) // 2] * 1000 if waits else 0.0,
+                'p99_ms': waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000 if waits else 0.0,
+                'max_ms': waits[-1] * 1000 if waits else 0.0,
+            }
+        stats['totals'] = {'slices': self._slices, 'target_misses': self._target_misses}
+        return stats
+
+# Shared scheduler used by the bot
+scheduler = WorkScheduler()
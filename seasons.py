@@ -0,0 +1,127 @@
+from datetime import datetime
+from typing import Generator, List, Optional
+import logging
+from sqlalchemy import select
+from models import Session, Season, User, Message
+from config import SEASON_COMPACT_BATCH_SIZE, SEASONS_KEEP_MESSAGES
+
+logger = logging.getLogger('LeaderboardBot')
+
+class SeasonInfo:
+    """Detached copy of a season row, safe to share across threads."""
+    __slots__ = ('id', 'number', 'started_at', 'ended_at', 'archived_at')
+
+    def __init__(self, season: Season):
+        self.id = season.id
+        self.number = season.number
+        self.started_at = season.started_at
+        self.ended_at = season.ended_at
+        self.archived_at = season.archived_at
+
+    def contains(self, timestamp: datetime) -> bool:
+        """Check whether a timestamp falls inside this season."""
+        timestamp = timestamp.replace(tzinfo=None)
+        return (self.started_at.replace(tzinfo=None) <= timestamp and
+                (self.ended_at is None or timestamp < self.ended_at.replace(tzinfo=None)))
+
+# Seasons ordered by number; the last one is current. Only a handful ever exist,
+# so they are cached in full and reloaded whenever a season starts or is archived.
+_seasons: List[SeasonInfo] = []
+
+def load_seasons(session: Session) -> List[SeasonInfo]:
+    """Reload the season cache from the database."""
+    global _seasons
+    _seasons = [SeasonInfo(season) for season in session.query(Season).order_by(Season.number)]
+    return _seasons
+
+def current_season(session: Optional[Session] = None) -> SeasonInfo:
+    """Return the current season, loading the cache on first use."""
+    if not _seasons:
+        if session is None:
+            session = Session()
+            try:
+                load_seasons(session)
+            finally:
+                session.close()
+        else:
+            load_seasons(session)
+    return _seasons[-1]
+
+def season_for(timestamp: datetime, session: Optional[Session] = None) -> Optional[SeasonInfo]:
+    """Find the season a message timestamp belongs to."""
+    current = current_season(session)
+    if current.contains(timestamp):
+        return current
+    for season in reversed(_seasons):
+        if season.contains(timestamp):
+            return season
+    return None
+
+def find_season(number: int) -> Optional[SeasonInfo]:
+    """Look up a season by its number."""
+    current_season()
+    return next((season for season in _seasons if season.number == number), None)
+
+def start_new_season() -> SeasonInfo:
+    """End the current season and start the next one.
+
+    This only closes one row and inserts another; the previous season's counters,
+    badges and messages are left untouched and remain queryable.
+    """
+    session = Session()
+    try:
+        now = datetime.utcnow()
+        previous = session.query(Season).filter(Season.ended_at.is_(None)).order_by(Season.number.desc()).first()
+        if previous:
+            previous.ended_at = now
+        season = Season(number=(previous.number + 1) if previous else 1, started_at=now)
+        session.add(season)
+        session.commit()
+        load_seasons(session)
+        logger.info(f"Started season {season.number}")
+        return current_season()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def seasons_to_compact() -> List[SeasonInfo]:
+    """Ended seasons past the message retention window that still have per-message rows."""
+    ended = [season for season in _seasons if season.ended_at is not None]
+    keep = SEASONS_KEEP_MESSAGES
+    candidates = ended[:-keep] if keep > 0 else ended
+    return [season for season in candidates if season.archived_at is None]
+
+def compact_season(season_id: int, batch_size: int = SEASON_COMPACT_BATCH_SIZE) -> Generator[None, None, int]:
+    """Scheduler job that deletes an ended season's per-message rows in small batches.
+
+    User counters, badges and activity patterns for the season are kept, so its
+    leaderboard stays available after compaction. Returns the number of rows deleted.
+    """
+    deleted = 0
+    season_users = select(User.id).where(User.season_id == season_id)
+    while True:
+        session = Session()
+        try:
+            ids = [row[0] for row in session.query(Message.id)
+                   .filter(Message.user_id.in_(season_users))
+                   .limit(batch_size)]
+            if ids:
+                session.query(Message).filter(Message.id.in_(ids)).delete(synchronize_session=False)
+            else:
+                session.query(Season).filter_by(id=season_id).update({'archived_at': datetime.utcnow()})
+                load_seasons(session)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        if not ids:
+            break
+        deleted += len(ids)
+        yield
+    logger.info(f"Compacted season {season_id}: removed {deleted} message rows")
+    return deleted
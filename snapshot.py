@@ -0,0 +1,147 @@
+import numpy as np
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+import json
+import logging
+import os
+import struct
+import zlib
+from models import Session, state_generation
+from activity import activity_matrix
+from standings import standings
+from seasons import current_season
+from config import SNAPSHOT_PATH
+
+logger = logging.getLogger('LeaderboardBot')
+
+MAGIC = b'LBSNAP\x00\x00'
+VERSION = 2
+# magic, format version, season id, database state generation, directory length, CRC32 of the rest
+HEADER = struct.Struct('<8sIqqII')
+ALIGNMENT = 64
+
+class SnapshotError(Exception):
+    """A snapshot file is missing, corrupt, or does not match the database."""
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def write_snapshot(path: str = SNAPSHOT_PATH) -> Optional[str]:
+    """Write the in-memory state to disk; returns the path, or None if there is nothing to save.
+
+    The file is a fixed header, a JSON directory describing each array, and the raw
+    array data at aligned offsets so it can be memory-mapped. It is written to a
+    temporary file and renamed into place, so a crash never leaves a torn snapshot.
+    """
+    if not standings.ready:
+        return None
+
+    # Runs on the worker thread that makes every write, so the generation matches the arrays
+    session = Session()
+    try:
+        season_id = standings.season_id
+        generation = state_generation(session)
+    finally:
+        session.close()
+
+    arrays = {f'standings.{name}': array for name, array in standings.arrays().items()}
+    arrays.update({f'activity.{name}': array for name, array in activity_matrix.arrays().items()})
+
+    entries, offset = [], 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        entries.append({'name': name, 'dtype': array.dtype.descr if array.dtype.names else array.dtype.str,
+                        'shape': list(array.shape), 'offset': offset})
+        offset = _align(offset + array.nbytes)
+    directory = json.dumps({
+        'arrays': entries,
+        'recent_hour': standings.recent_hour,
+        'written_at': datetime.utcnow().isoformat(),
+    }).encode('utf-8')
+
+    data_start = _align(HEADER.size + len(directory))
+    body = bytearray(data_start - HEADER.size + offset)
+    body[:len(directory)] = directory
+    for entry, array in zip(entries, arrays.values()):
+        start = data_start - HEADER.size + entry['offset']
+        body[start:start + array.nbytes] = np.ascontiguousarray(array).tobytes()
+
+    header = HEADER.pack(MAGIC, VERSION, season_id, generation, len(directory), zlib.crc32(body))
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as snapshot_file:
+        snapshot_file.write(header)
+        snapshot_file.write(body)
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote state snapshot for {len(standings.index)} users ({HEADER.size + len(body)} bytes)")
+    return path
+
+def read_snapshot(path: str = SNAPSHOT_PATH) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """Memory-map a snapshot and return its metadata and read-only array views.
+
+    Raises SnapshotError if the file is missing, of another format version, or
+    fails its checksum.
+    """
+    if not os.path.exists(path):
+        raise SnapshotError("no snapshot file")
+    buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    if len(buffer) < HEADER.size:
+        raise SnapshotError("snapshot is truncated")
+
+    magic, version, season_id, generation, directory_length, checksum = HEADER.unpack(
+        buffer[:HEADER.size].tobytes())
+    if magic != MAGIC:
+        raise SnapshotError("not a snapshot file")
+    if version != VERSION:
+        raise SnapshotError(f"snapshot format version {version}, expected {VERSION}")
+    if zlib.crc32(buffer[HEADER.size:]) != checksum:
+        raise SnapshotError("snapshot checksum mismatch")
+
+    meta = json.loads(buffer[HEADER.size:HEADER.size + directory_length].tobytes())
+    meta.update(season_id=season_id, generation=generation)
+    data_start = _align(HEADER.size + directory_length)
+    arrays = {}
+    for entry in meta['arrays']:
+        dtype = np.dtype([tuple(field) for field in entry['dtype']] if isinstance(entry['dtype'], list)
+                         else entry['dtype'])
+        arrays[entry['name']] = np.ndarray(entry['shape'], dtype=dtype, buffer=buffer,
+                                           offset=data_start + entry['offset'])
+    return meta, arrays
+
+def restore_snapshot(session: Session, path: str = SNAPSHOT_PATH) -> bool:
+    """Load the in-memory state from a snapshot if it matches the database.
+
+    Returns False, leaving the state untouched, when the snapshot is missing,
+    corrupt, or stale; the caller then rebuilds from the database.
+    """
+    try:
+        meta, arrays = read_snapshot(path)
+        season_id = current_season(session).id
+        if meta['season_id'] != season_id:
+            raise SnapshotError(f"snapshot is for season id {meta['season_id']}, current is {season_id}")
+        if meta['generation'] != state_generation(session):
+            raise SnapshotError("the database changed after the snapshot was written")
+
+        standings.restore(session, season_id, {
+            name.split('.', 1)[1]: array for name, array in arrays.items() if name.startswith('standings.')
+        }, meta['recent_hour'])
+        activity_matrix.restore({
+            name.split('.', 1)[1]: array for name, array in arrays.items() if name.startswith('activity.')
+        })
+    except (SnapshotError, KeyError, ValueError, TypeError) as e:
+        logger.info(f"Not using state snapshot: {str(e)}")
+        return False
+
+    logger.info(f"Restored state snapshot for {len(standings.index)} users (written {meta['written_at']})")
+    return True
+
+def load_state(path: str = SNAPSHOT_PATH):
+    """Restore the in-memory state from the snapshot, or rebuild it from the database."""
+    session = Session()
+    try:
+        if not restore_snapshot(session, path):
+            activity_matrix.load(session)
+            standings.load(session, current_season(session).id)
+    finally:
+        session.close()
@@ -0,0 +1,252 @@
+import numpy as np
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+from models import Session, User, Message, Badge, UserBadge
+from config import LEADERBOARD_SORT
+
+logger = logging.getLogger('LeaderboardBot')
+
+RECENT_HOURS = 24
+EPOCH = datetime(1970, 1, 1)
+
+# One row per user; badge_mask has bit n set when the badge with id n is earned
+ROW_DTYPE = np.dtype([
+    ('user_id', '<i8'),
+    ('discord_id', '<i8'),
+    ('total_messages', '<i8'),
+    ('streak', '<i8'),
+    ('best_streak', '<i8'),
+    ('replies_received', '<i8'),
+    ('reactions_received', '<i8'),
+    ('score', '<f8'),
+    ('badge_mask', '<i8'),
+])
+
+USER_COLUMNS = (User.id, User.discord_id, User.total_messages, User.streak, User.best_streak,
+                User.replies_received, User.reactions_received, User.score)
+
+def _epoch_hour(timestamp: datetime) -> int:
+    """Hours since the epoch; naive timestamps are UTC like everything stored."""
+    return int((timestamp.replace(tzinfo=None) - EPOCH).total_seconds() // 3600)
+
+class LeaderboardEntry:
+    """Detached leaderboard row with the fields the leaderboard embed shows."""
+    __slots__ = ('user_id', 'discord_id', 'total_messages', 'streak', 'best_streak',
+                 'replies_received', 'reactions_received', 'score', 'recent_messages', 'badge_emojis')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_user(cls, user: User, recent_messages: int = 0) -> 'LeaderboardEntry':
+        return cls(
+            user_id=user.id, discord_id=user.discord_id, total_messages=user.total_messages or 0,
+            streak=user.streak or 0, best_streak=user.best_streak or 0,
+            replies_received=user.replies_received or 0, reactions_received=user.reactions_received or 0,
+            score=user.score or 0.0, recent_messages=recent_messages,
+            badge_emojis=[user_badge.badge.emoji
+                          for user_badge in sorted(user.badges, key=lambda user_badge: user_badge.badge_id)]
+        )
+
+class Standings:
+    """The current season's leaderboard held in NumPy arrays.
+
+    ``rows`` holds each user's counters and earned badges, and ``recent`` their
+    message counts in hourly buckets covering the last day; ``recent_hour`` is the
+    hour (since the epoch) of the newest bucket. Rank order is computed from the
+    arrays and cached until a row changes. Ingestion keeps the arrays current, so
+    the leaderboard is served without querying the database. ``version`` grows
+    with every change, so readers can tell whether what they hold is current.
+    """
+    def __init__(self, capacity: int = 64):
+        self.season_id: Optional[int] = None
+        self.ready = False
+        self.index: Dict[int, int] = {}
+        self.rows = np.zeros(capacity, dtype=ROW_DTYPE)
+        self.recent = np.zeros((capacity, RECENT_HOURS), dtype=np.int64)
+        self.recent_hour = _epoch_hour(datetime.utcnow())
+        self.badge_emojis: Dict[int, str] = {}
+        self._order: Optional[np.ndarray] = None
+        self.version = 0
+
+    def reset(self, season_id: int):
+        """Start empty standings for a season."""
+        self.version += 1
+        self.season_id = season_id
+        self.index.clear()
+        self.rows[:] = 0
+        self.recent[:] = 0
+        self.recent_hour = _epoch_hour(datetime.utcnow())
+        self._order = None
+        self.ready = True
+
+    def _row(self, user_id: int) -> int:
+        """Return the row for a user, growing the arrays when they are full."""
+        row = self.index.get(user_id)
+        if row is not None:
+            return row
+
+        row = len(self.index)
+        if row >= len(self.rows):
+            rows = np.zeros(len(self.rows) * 2, dtype=ROW_DTYPE)
+            rows[:row] = self.rows[:row]
+            recent = np.zeros((len(rows), RECENT_HOURS), dtype=np.int64)
+            recent[:row] = self.recent[:row]
+            self.rows, self.recent = rows, recent
+        self.index[user_id] = row
+        self.rows[row]['user_id'] = user_id
+        return row
+
+    def _advance(self, hour: int):
+        """Rotate the hourly buckets forward so the newest one is ``hour``."""
+        shift = hour - self.recent_hour
+        if shift <= 0:
+            return
+        if shift >= RECENT_HOURS:
+            self.recent[:] = 0
+        else:
+            self.recent[:, :-shift] = self.recent[:, shift:]
+            self.recent[:, -shift:] = 0
+        self.recent_hour = hour
+
+    def _load_badge_emojis(self, session: Session):
+        self.badge_emojis = dict(session.query(Badge.id, Badge.emoji))
+
+    def load(self, session: Session, season_id: int):
+        """Build the standings for a season from the database."""
+        self.reset(season_id)
+        self._load_badge_emojis(session)
+        self._update_rows(session.query(*USER_COLUMNS).filter(User.season_id == season_id))
+        self._update_badges(session.query(UserBadge.user_id, UserBadge.badge_id)
+                            .join(User).filter(User.season_id == season_id))
+
+        since = datetime.utcnow() - timedelta(hours=RECENT_HOURS)
+        for user_id, timestamp in (session.query(Message.user_id, Message.timestamp)
+                                   .join(User).filter(User.season_id == season_id,
+                                                      Message.timestamp >= since)):
+            self.record_message(user_id, timestamp)
+        logger.info(f"Loaded standings for {len(self.index)} users")
+
+    def _update_rows(self, rows: Iterable):
+        for user_id, discord_id, total, streak, best_streak, replies, reactions, score in rows:
+            row_number = self._row(user_id)  # May grow the arrays, so index afterwards
+            row = self.rows[row_number]
+            row['discord_id'] = discord_id
+            row['total_messages'] = total or 0
+            row['streak'] = streak or 0
+            row['best_streak'] = best_streak or 0
+            row['replies_received'] = replies or 0
+            row['reactions_received'] = reactions or 0
+            row['score'] = score or 0.0
+        self._order = None
+
+    def _update_badges(self, pairs: Iterable):
+        for user_id, badge_id in pairs:
+            if user_id in self.index:
+                self.rows[self.index[user_id]]['badge_mask'] |= 1 << badge_id
+
+    def refresh_users(self, session: Session, user_ids: Iterable[int]):
+        """Re-read the given users' counters and badges after they were written."""
+        self.version += 1
+        if not self.ready:
+            return
+        user_ids = list(set(user_ids))
+        if not user_ids:
+            return
+        self._update_rows(session.query(*USER_COLUMNS).filter(
+            User.id.in_(user_ids), User.season_id == self.season_id))
+        for user_id in user_ids:
+            if user_id in self.index:
+                self.rows[self.index[user_id]]['badge_mask'] = 0
+        self._update_badges(session.query(UserBadge.user_id, UserBadge.badge_id)
+                            .filter(UserBadge.user_id.in_(user_ids)))
+
+    def record_message(self, user_id: int, timestamp: datetime, count: int = 1):
+        """Count a current-season message in the rolling 24-hour buckets (a negative count removes it)."""
+        self.version += 1
+        if not self.ready:
+            return
+        now_hour = _epoch_hour(datetime.utcnow())
+        self._advance(now_hour)
+        age = now_hour - _epoch_hour(timestamp)
+        if 0 <= age < RECENT_HOURS:
+            row = self._row(user_id)
+            self.recent[row, RECENT_HOURS - 1 - age] += count
+
+    def order(self) -> np.ndarray:
+        """Row numbers in leaderboard order."""
+        if self._order is None:
+            rows = self.rows[:len(self.index)]
+            # Same order as the database query: ranking column, messages, then user id
+            if LEADERBOARD_SORT == 'score':
+                self._order = np.lexsort((rows['user_id'], -rows['total_messages'], -rows['score']))
+            else:
+                self._order = np.lexsort((rows['user_id'], -rows['total_messages']))
+        return self._order
+
+    def entries(self) -> List[LeaderboardEntry]:
+        """The leaderboard as detached rows, best first."""
+        self._advance(_epoch_hour(datetime.utcnow()))
+        recent = self.recent[:len(self.index)].sum(axis=1)
+        entries = []
+        for row_number in self.order():
+            row = self.rows[row_number]
+            if row['total_messages'] <= 0:
+                continue  # Every message this user sent was deleted
+            mask = int(row['badge_mask'])
+            entries.append(LeaderboardEntry(
+                user_id=int(row['user_id']), discord_id=int(row['discord_id']),
+                total_messages=int(row['total_messages']), streak=int(row['streak']),
+                best_streak=int(row['best_streak']), replies_received=int(row['replies_received']),
+                reactions_received=int(row['reactions_received']), score=float(row['score']),
+                recent_messages=int(recent[row_number]),
+                badge_emojis=[emoji for badge_id, emoji in sorted(self.badge_emojis.items())
+                              if mask >> badge_id & 1]
+            ))
+        return entries
+
+    def leaderboard_size(self) -> int:
+        """How many users ``entries()`` returns."""
+        return int((self.rows['total_messages'][:len(self.index)] > 0).sum())
+
+    def has_user(self, discord_id: int) -> bool:
+        """Whether the user has a row this season."""
+        return bool((self.rows['discord_id'][:len(self.index)] == discord_id).any())
+
+    def window_ranking(self, hours: int) -> List[Tuple[int, int]]:
+        """(discord_id, messages) over the last ``hours`` hours, most active first."""
+        self._advance(_epoch_hour(datetime.utcnow()))
+        count = len(self.index)
+        rows = self.rows[:count]
+        recent = self.recent[:count, RECENT_HOURS - hours:].sum(axis=1)
+        order = np.lexsort((rows['user_id'], -rows['total_messages'], -recent))
+        return [(int(rows[row]['discord_id']), int(recent[row])) for row in order if recent[row] > 0]
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """The state to persist, trimmed to the rows in use."""
+        count = len(self.index)
+        return {
+            'rows': self.rows[:count],
+            'recent': self.recent[:count],
+            'order': self.order().astype(np.int64),
+        }
+
+    def restore(self, session: Session, season_id: int, arrays: Dict[str, np.ndarray], recent_hour: int):
+        """Replace the standings with previously persisted arrays."""
+        self.reset(season_id)
+        self._load_badge_emojis(session)
+        count = len(arrays['rows'])
+        capacity = max(64, 1 << max(count - 1, 0).bit_length())
+        self.rows = np.zeros(capacity, dtype=ROW_DTYPE)
+        self.rows[:count] = arrays['rows']
+        self.recent = np.zeros((capacity, RECENT_HOURS), dtype=np.int64)
+        self.recent[:count] = arrays['recent']
+        self.recent_hour = recent_hour
+        self.index = {int(user_id): row for row, user_id in enumerate(self.rows['user_id'][:count])}
+        self._order = np.array(arrays['order'], dtype=np.int64)
+        self._advance(_epoch_hour(datetime.utcnow()))
+
+# Shared standings used by the bot
+standings = Standings()
@@ -1,25 +1,148 @@
 import discord
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Generator
 import asyncio
-from models import Session, User, Message, ActivityPattern, Badge, UserBadge
-from config import NIGHT_OWL_HOURS, EARLY_BIRD_HOURS
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+from models import engine, Session, User, Message, UserBadge
+from config import (
+    BACKFILL_CHUNK_SIZE, DELETE_BATCH_SIZE, LOG_LEVEL, LOG_FILE,
+    LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_FORMAT, LOG_RATE_LIMIT, LOG_RATE_PERIOD, BACKUP_DIR
+)
+from activity import DAY_NAMES, activity_matrix, weekday_occurrences, render_heatmap
+from seasons import SeasonInfo, current_season
+from writes import (
+    ingest_messages, remove_messages, channel_message_ids, channel_cursor, advance_channel_cursor,
+    clear_channel_cursors
+)
+from engagement import engagement_tracker, ranking_column
+from standings import LeaderboardEntry, standings
+import atexit
+import copy
+import json
 import logging
+import os
+import queue
+import sqlite3
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from functools import wraps
 from collections import defaultdict
 
 logger = logging.getLogger('LeaderboardBot')
 
-def setup_logging():
-    """Configure logging for the bot."""
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
-        handlers=[
-            logging.StreamHandler(),
-            logging.FileHandler('bot.log')
-        ]
+class JsonFormatter(logging.Formatter):
+    """Format log records as one JSON object per line."""
+    RESERVED = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName,
+        }
+        # Anything passed through ``extra=`` becomes a structured field
+        for key, value in vars(record).items():
+            if key not in self.RESERVED and not key.startswith('_'):
+                entry[key] = value if isinstance(value, (int, float, str, bool, type(None))) else str(value)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class StructuredQueueHandler(QueueHandler):
+    """Queue handler that keeps exception text separate from the message."""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class CallSiteRateLimitFilter(logging.Filter):
+    """Rate-limit and sample log records per call site.
+
+    Each source line may emit ``limit`` records per ``period`` seconds; the rest are
+    dropped and counted, and the count is attached to the next record that gets
+    through. A call can also ask to be sampled with ``extra={'sample_every': n}``,
+    which keeps only every n-th record from that line. Warnings and errors are
+    never limited or sampled, so a burst of failures is logged in full.
+    """
+    def __init__(self, limit: int, period: float):
+        super().__init__()
+        self.limit = limit
+        self.period = period
+        self._windows: Dict[Tuple[str, int], List[float]] = {}
+        self._calls: Dict[Tuple[str, int], int] = defaultdict(int)
+        self._suppressed: Dict[Tuple[str, int], int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        site = (record.pathname, record.lineno)
+        now = record.created
+        with self._lock:
+            sample_every = getattr(record, 'sample_every', 1)
+            self._calls[site] += 1
+            if sample_every > 1 and self._calls[site] % sample_every != 1:
+                return False
+
+            window = self._windows.setdefault(site, [now, 0])
+            if now - window[0] >= self.period:
+                window[0], window[1] = now, 0
+            if self.limit and window[1] >= self.limit:
+                self._suppressed[site] += 1
+                return False
+            window[1] += 1
+
+            suppressed = self._suppressed.pop(site, 0)
+        if suppressed:
+            record.msg = f"{record.getMessage()} (suppressed {suppressed} similar messages)"
+            record.args = None
+            record.suppressed = suppressed
+        return True
+
+def setup_logging(log_file: str = LOG_FILE, level: str = LOG_LEVEL,
+                  rate_limit: int = LOG_RATE_LIMIT) -> QueueListener:
+    """Configure non-blocking logging for the bot.
+    
+    Callers only enqueue records; a background QueueListener thread formats them
+    and does the console and rotating-file I/O, so logging never blocks the event loop.
+    """
+    log_queue = queue.SimpleQueue()
+    
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s'))
+    file_handler = RotatingFileHandler(
+        log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
     )
+    file_handler.setFormatter(
+        JsonFormatter() if LOG_FORMAT == 'json'
+        else logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+    )
+    
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(CallSiteRateLimitFilter(rate_limit, LOG_RATE_PERIOD))
+    
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    
+    listener = QueueListener(log_queue, stream_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
 
 def rate_limit(calls: int, period: float):
     """Rate limiting decorator for commands."""
@@ -49,129 +172,217 @@ def rate_limit(calls: int, period: float):
         return wrapper
     return decorator
 
-async def create_backup():
-    """Create a backup of the database."""
+def _backup_sqlite(source_path: str, backup_path: str):
+    """Copy a live SQLite database with the online backup API."""
+    source = sqlite3.connect(source_path)
+    try:
+        target = sqlite3.connect(backup_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+async def create_backup() -> Optional[str]:
+    """Create a backup of the database; returns the backup path, or None on failure.
+    
+    SQLite databases are copied with the online backup API; PostgreSQL databases
+    are dumped with ``pg_dump``, which must be on the PATH.
+    """
     try:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_command = f'sqlite3 leaderboard.db ".backup \'backups/leaderboard_{timestamp}.db\'"'
-        process = await asyncio.create_subprocess_shell(
-            backup_command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        await process.communicate()
-        logger.info(f"Database backup created: leaderboard_{timestamp}.db")
+        url = engine.url
+        if url.get_backend_name() == 'sqlite':
+            backup_path = os.path.join(BACKUP_DIR, f'leaderboard_{timestamp}.db')
+            await asyncio.to_thread(_backup_sqlite, url.database, backup_path)
+        elif url.get_backend_name() == 'postgresql':
+            backup_path = os.path.join(BACKUP_DIR, f'leaderboard_{timestamp}.dump')
+            # pg_dump takes a libpq URL, without the SQLAlchemy driver suffix
+            libpq_url = url.set(drivername='postgresql').render_as_string(hide_password=False)
+            process = await asyncio.create_subprocess_exec(
+                'pg_dump', '--format=custom', f'--file={backup_path}', libpq_url,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(f"pg_dump exited with {process.returncode}: {stderr.decode().strip()}")
+        else:
+            raise NotImplementedError(f"No backup method for {url.get_backend_name()}")
+        logger.info(f"Database backup created: {backup_path}")
+        return backup_path
     except Exception as e:
         logger.error(f"Backup failed: {str(e)}")
+        return None
 
-def update_user_stats(session: Session, user_id: str, message_timestamp: datetime) -> User:
-    """Update user statistics when a new message is processed."""
-    user = session.query(User).filter_by(discord_id=user_id).first()
-    if not user:
-        user = User(
-            discord_id=user_id,
-            total_messages=0,
-            streak=0,
-            best_streak=0,
-            night_owl_messages=0,
-            early_bird_messages=0,
-            weekend_messages=0,
-            weekday_messages=0
-        )
-        session.add(user)
-        session.flush()  # This will assign an ID to the user
+def _commit_messages(records: List[Tuple]) -> List[Tuple[int, datetime]]:
+    """Ingest message records in one transaction.
     
-    # Update basic stats
-    if user.total_messages is None:
-        user.total_messages = 0
-    user.total_messages += 1
+    Returns (user id, timestamp) for new messages in the current season, which are
+    the ones the in-memory activity matrix tracks.
+    """
+    with engine.begin() as conn:
+        stored = ingest_messages(conn, records)
+    engagement_tracker.note_stored([message_id for message_id, _, _, _ in stored])
     
-    current_date = message_timestamp.date()
+    current_season_id = current_season().id
+    ingested = [(user_id, timestamp) for _, user_id, season_id, timestamp in stored
+                if season_id == current_season_id]
+    # Past-season rows are served too, so any stored message moves the standings version on
+    if stored:
+        session = Session()
+        try:
+            standings.refresh_users(session, [user_id for user_id, _ in ingested])
+        finally:
+            session.close()
+    return ingested
+
+def store_message(message_id: int, author_id: int, channel_id: int, timestamp: datetime,
+                  reply_to_id: Optional[int] = None) -> bool:
+    """Ingest a single live message; returns True if it was new to the current season."""
+    ingested = _commit_messages([(message_id, author_id, channel_id, timestamp, reply_to_id)])
+    for user_id, message_timestamp in ingested:
+        activity_matrix.record(user_id, message_timestamp)
+        standings.record_message(user_id, message_timestamp)
+    return bool(ingested)
+
+def store_message_batch(records: List[Tuple], chunk_size: int = BACKFILL_CHUNK_SIZE) -> Generator[None, None, int]:
+    """Scheduler job that ingests (message_id, author_id, channel_id, timestamp[, reply_to_id]) records.
     
-    # Update streak
-    if user.last_active_date:
-        last_date = user.last_active_date.date()
-        days_diff = (current_date - last_date).days
+    Each chunk is committed before yielding, so the job never holds a transaction
+    open while it is paused. Returns the number of messages newly stored in the
+    current season.
+    """
+    new_messages = 0
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start:start + chunk_size]
+        try:
+            ingested = _commit_messages(chunk)
+        except Exception as e:
+            logger.warning(f"Batch insert failed, retrying messages one by one: {str(e)}")
+            ingested = []
+            for record in chunk:
+                try:
+                    ingested.extend(_commit_messages([record]))
+                except Exception as e:
+                    logger.error(f"Error processing message {record[0]}: {str(e)}")
         
-        if days_diff == 1:
-            if user.streak is None:
-                user.streak = 0
-            user.streak += 1
-            if user.best_streak is None:
-                user.best_streak = 0
-            user.best_streak = max(user.streak, user.best_streak)
-        elif days_diff > 1:
-            user.streak = 1
-    else:
-        user.streak = 1
-    
-    user.last_active_date = message_timestamp
-    
-    # Initialize counters if they're None
-    if user.night_owl_messages is None:
-        user.night_owl_messages = 0
-    if user.early_bird_messages is None:
-        user.early_bird_messages = 0
-    if user.weekend_messages is None:
-        user.weekend_messages = 0
-    if user.weekday_messages is None:
-        user.weekday_messages = 0
-    
-    # Update time-based stats
-    hour = message_timestamp.hour
-    if hour in NIGHT_OWL_HOURS:
-        user.night_owl_messages += 1
-    elif hour in EARLY_BIRD_HOURS:
-        user.early_bird_messages += 1
-    
-    # Update day-based stats
-    if message_timestamp.weekday() >= 5:  # Weekend (5=Saturday, 6=Sunday)
-        user.weekend_messages += 1
-    else:
-        user.weekday_messages += 1
+        for user_id, timestamp in ingested:
+            activity_matrix.record(user_id, timestamp)
+            standings.record_message(user_id, timestamp)
+        new_messages += len(ingested)
+        yield
+    return new_messages
+
+def delete_messages(message_ids: List[int]) -> int:
+    """Stop counting deleted current-season messages; returns how many of them were stored.
+    
+    Works from our own table, so it does not matter whether Discord still had the
+    messages cached. Messages from ended seasons are left alone.
+    """
+    # Reply links are only counted on flush, so apply pending ones before reversing them
+    engagement_tracker.flush()
+    with engine.begin() as conn:
+        removed, user_ids = remove_messages(conn, message_ids)
     
-    return user
+    current_season_id = current_season().id
+    for user_id, season_id, timestamp in removed:
+        if season_id == current_season_id and timestamp is not None:
+            activity_matrix.record(user_id, timestamp, -1)
+            standings.record_message(user_id, timestamp, -1)
+    if user_ids:
+        session = Session()
+        try:
+            standings.refresh_users(session, user_ids)
+        finally:
+            session.close()
+    return len(removed)
 
-def check_and_award_badges(session: Session, user: User):
-    """Check if user qualifies for any new badges and award them."""
-    all_badges = session.query(Badge).all()
+def delete_channel_messages(channel_ids: List[int], batch_size: int = DELETE_BATCH_SIZE) -> Generator[None, None, int]:
+    """Scheduler job that stops counting every current-season message from the given channels.
     
-    for badge in all_badges:
-        # Skip if user already has this badge
-        if session.query(UserBadge).filter_by(user_id=user.id, badge_id=badge.id).first():
-            continue
-        
-        awarded = False
-        if badge.requirement_type == 'percentage':
-            if badge.name == 'Night Owl':
-                percentage = (user.night_owl_messages / user.total_messages * 100
-                            if user.total_messages > 0 else 0)
-                awarded = percentage >= badge.requirement_value
-            elif badge.name == 'Early Bird':
-                percentage = (user.early_bird_messages / user.total_messages * 100
-                            if user.total_messages > 0 else 0)
-                awarded = percentage >= badge.requirement_value
-            elif badge.name == 'Weekend Warrior':
-                percentage = (user.weekend_messages / user.total_messages * 100
-                            if user.total_messages > 0 else 0)
-                awarded = percentage >= badge.requirement_value
-        elif badge.requirement_type == 'streak':
-            awarded = user.streak >= badge.requirement_value
-        
-        if awarded:
-            user_badge = UserBadge(user_id=user.id, badge_id=badge.id)
-            session.add(user_badge)
+    Returns the number of messages removed.
+    """
+    removed = 0
+    while True:
+        with engine.connect() as conn:
+            message_ids = channel_message_ids(conn, channel_ids, batch_size)
+        if not message_ids:
+            break
+        removed += delete_messages(message_ids)
+        yield
+    with engine.begin() as conn:
+        clear_channel_cursors(conn, channel_ids)
+    return removed
+
+def load_channel_cursor(channel_id: int) -> Optional[int]:
+    """Newest message ID the history backfill has read in a channel, if any."""
+    with engine.connect() as conn:
+        return channel_cursor(conn, channel_id)
+
+def backfill_batch(channel_id: int, records: List[Tuple], last_message_id: int) -> Generator[None, None, int]:
+    """Scheduler job that stores a batch of channel history, then advances the channel's cursor.
+    
+    The cursor only moves once the whole batch is stored, so an interrupted
+    backfill resumes from the last complete batch.
+    """
+    new_messages = yield from store_message_batch(records)
+    with engine.begin() as conn:
+        advance_channel_cursor(conn, channel_id, last_message_id)
+    return new_messages
+
+def get_recent_message_counts(session: Session) -> Dict[int, int]:
+    """Get the number of messages each user sent in the last 24 hours."""
+    yesterday = datetime.utcnow() - timedelta(days=1)
+    return dict(
+        session.query(Message.user_id, func.count(Message.id))
+        .filter(Message.timestamp >= yesterday)
+        .group_by(Message.user_id)
+        .all()
+    )
 
-def create_leaderboard_embed(guild: discord.Guild, users: List[User], page: int = 0, 
-                           users_per_page: int = 10) -> discord.Embed:
+def load_leaderboard_users(season_id: Optional[int] = None) -> List[LeaderboardEntry]:
+    """Load a season's users in leaderboard order with badges and 24h message counts attached.
+    
+    The current season is served from the in-memory standings; past seasons are
+    read from the database.
+    """
+    if standings.ready and season_id in (None, standings.season_id):
+        return standings.entries()
+    
+    session = Session()
+    try:
+        season_id = season_id or current_season(session).id
+        users = (
+            session.query(User)
+            .options(selectinload(User.badges).selectinload(UserBadge.badge))
+            .filter(User.season_id == season_id, User.total_messages > 0)
+            .order_by(ranking_column().desc(), User.total_messages.desc(), User.id)
+            .all()
+        )
+        recent_counts = get_recent_message_counts(session)
+        return [LeaderboardEntry.from_user(user, recent_counts.get(user.id, 0)) for user in users]
+    finally:
+        session.close()
+
+def create_leaderboard_embed(guild: discord.Guild, users: List[LeaderboardEntry], page: int = 0, 
+                           users_per_page: int = 10, season: Optional[SeasonInfo] = None) -> discord.Embed:
     """Create a formatted embed for the leaderboard."""
     start_idx = page * users_per_page
     page_users = users[start_idx:start_idx + users_per_page]
     total_pages = (len(users) + users_per_page - 1) // users_per_page
+    season = season or current_season()
     
+    if season.ended_at:
+        description = (f"Final standings for season {season.number} "
+                       f"({season.started_at:%Y-%m-%d} to {season.ended_at:%Y-%m-%d})")
+    else:
+        description = "Most active members in the server!"
     embed = discord.Embed(
-        title="🏆 Activity Leaderboard 🏆",
-        description="Most active members in the server!",
+        title=f"🏆 Activity Leaderboard • Season {season.number} 🏆",
+        description=description,
         color=0xFF9300
     )
     
@@ -179,7 +390,7 @@ def create_leaderboard_embed(guild: discord.Guild, users: List[User], page: int
         embed.set_thumbnail(url=guild.icon.url)
     
     for idx, user in enumerate(page_users, start=start_idx + 1):
-        member = guild.get_member(int(user.discord_id))
+        member = guild.get_member(user.discord_id)
         
         # Handle users who have left the server
         if member:
@@ -190,7 +401,7 @@ def create_leaderboard_embed(guild: discord.Guild, users: List[User], page: int
             left_indicator = "👋 "  # Add waving hand emoji for users who left
         
         trophy = "🥇" if idx == 1 else "🥈" if idx == 2 else "🥉" if idx == 3 else ""
-        badges = [ub.badge.emoji for ub in user.badges]
+        badges = user.badge_emojis
         badge_str = " ".join(badges) if badges else ""
         
         # Get user's roles and check for special roles (only if user is still in server)
@@ -204,15 +415,17 @@ def create_leaderboard_embed(guild: discord.Guild, users: List[User], page: int
         
         name = f"{left_indicator}{trophy}#{idx} {display_name} {special_emoji} {badge_str}"
         value = (
+            f"Score: **{user.score or 0:.0f}** "
+            f"(💬 {user.replies_received or 0} replies • ⭐ {user.reactions_received or 0} reactions)\n"
             f"Total Messages: **{user.total_messages}**\n"
-            f"Last 24 hours: **{getattr(user, 'recent_messages', 0)}**\n"
+            f"Last 24 hours: **{user.recent_messages}**\n"
             f"Current Streak: **{user.streak}** days\n"
             f"Best Streak: **{user.best_streak}** days"
         )
         
         embed.add_field(name=name.strip(), value=value, inline=False)
     
-    embed.set_footer(text=f"Page {page + 1}/{total_pages} • "
+    embed.set_footer(text=f"Season {season.number} • Page {page + 1}/{total_pages} • "
                          f"Updated at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     return embed
 
@@ -229,9 +442,18 @@ def create_user_stats_embed(member: discord.Member, user: User) -> discord.Embed
                f"Best Streak: **{user.best_streak}** days")
     embed.add_field(name="📈 Overview", value=overview, inline=False)
     
-    # Activity Patterns
-    weekday_avg = user.weekday_messages / 5 if user.weekday_messages > 0 else 0
-    weekend_avg = user.weekend_messages / 2 if user.weekend_messages > 0 else 0
+    engagement = (f"Score: **{user.score or 0:.0f}**\n"
+                  f"Replies Received: **{user.replies_received or 0}**\n"
+                  f"Reactions Received: **{user.reactions_received or 0}**")
+    embed.add_field(name="🤝 Engagement", value=engagement, inline=False)
+    
+    # Activity Patterns, averaged over the days that actually elapsed since the first message
+    today = datetime.utcnow().date()
+    first_active = (user.first_active_date or user.last_active_date or datetime.utcnow()).date()
+    days_elapsed = weekday_occurrences(first_active, today)
+    weekdays, weekend_days = days_elapsed[:5].sum(), days_elapsed[5:].sum()
+    weekday_avg = user.weekday_messages / weekdays if weekdays > 0 else 0
+    weekend_avg = user.weekend_messages / weekend_days if weekend_days > 0 else 0
     patterns = (f"Weekday Average: **{weekday_avg:.1f}** messages/day\n"
                f"Weekend Average: **{weekend_avg:.1f}** messages/day\n"
                f"Night Owl Activity: **{user.night_owl_messages}** messages\n"
@@ -244,4 +466,35 @@ def create_user_stats_embed(member: discord.Member, user: User) -> discord.Embed
                            for ub in user.badges])
         embed.add_field(name="🏆 Badges Earned", value=badges, inline=False)
     
-    return embed 
\ No newline at end of file
+    return embed 
+
+def create_activity_embed(title: str, summary: Dict[str, Any], counts) -> discord.Embed:
+    """Create a formatted embed with an activity heatmap and peak-hour analytics."""
+    embed = discord.Embed(title=f"🗓️ {title}", color=0x5865F2)
+    
+    if summary['total'] == 0:
+        embed.description = "No activity recorded yet!"
+        return embed
+    
+    embed.description = f"```\n{render_heatmap(counts)}\n```Hours are in UTC."
+    
+    peak_hours = "\n".join(
+        f"**{hour:02d}:00-{(hour + 1) % 24:02d}:00** ({summary['hour_counts'][hour]} messages)"
+        for hour in summary['peak_hours']
+    )
+    embed.add_field(name="⏰ Peak Hours", value=peak_hours or "None", inline=True)
+    
+    averages = "\n".join(
+        f"{'**' if day == summary['busiest_day'] else ''}{name}: {average:.1f}"
+        f"{'**' if day == summary['busiest_day'] else ''}"
+        for day, (name, average) in enumerate(zip(DAY_NAMES, summary['daily_averages']))
+    )
+    embed.add_field(name="📅 Messages per Day", value=averages, inline=True)
+    
+    overview = (f"Total Messages: **{summary['total']}**\n"
+               f"Weekday Average: **{summary['weekday_average']:.1f}** messages/day\n"
+               f"Weekend Average: **{summary['weekend_average']:.1f}** messages/day\n"
+               f"Days Tracked: **{summary['days_tracked']}**")
+    embed.add_field(name="📈 Overview", value=overview, inline=False)
+    
+    return embed
@@ -0,0 +1,387 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import logging
+from sqlalchemy import Date, and_, bindparam, case, cast, delete, func, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from models import User, Message, ActivityPattern, Badge, UserBadge, ChannelCursor
+from seasons import current_season, season_for
+from engagement import engagement_score
+from config import NIGHT_OWL_HOURS, EARLY_BIRD_HOURS, SCORE_WEIGHT_MESSAGES
+
+logger = logging.getLogger('LeaderboardBot')
+
+users = User.__table__
+messages = Message.__table__
+activity_patterns = ActivityPattern.__table__
+user_badges = UserBadge.__table__
+channel_cursors = ChannelCursor.__table__
+
+# Rows per multi-row INSERT, kept under SQLite's bound parameter limit
+STATEMENT_BATCH_SIZE = 500
+
+# Badge definitions rarely change, so they are read once
+_badges: Optional[List[Tuple]] = None
+
+def _insert(conn: Connection, table):
+    """INSERT construct for the connection's dialect, with ON CONFLICT support."""
+    if conn.dialect.name == 'postgresql':
+        return postgresql.insert(table)
+    if conn.dialect.name == 'sqlite':
+        return sqlite.insert(table)
+    raise NotImplementedError(f"Upserts are not supported on {conn.dialect.name}")
+
+def _day_diff(conn: Connection, later, earlier):
+    """Whole calendar days between two timestamp expressions."""
+    if conn.dialect.name == 'sqlite':
+        return func.julianday(func.date(later)) - func.julianday(func.date(earlier))
+    return cast(later, Date) - cast(earlier, Date)
+
+def _batches(rows: List, size: int = STATEMENT_BATCH_SIZE):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+def ensure_users(conn: Connection, keys: Set[Tuple[int, int]]) -> Dict[Tuple[int, int], int]:
+    """Create any missing (season_id, discord_id) user rows and return every row's id."""
+    ids = {}
+    rows = [
+        {'season_id': season_id, 'discord_id': discord_id, 'total_messages': 0, 'streak': 0,
+         'best_streak': 0, 'night_owl_messages': 0, 'early_bird_messages': 0, 'weekend_messages': 0,
+         'weekday_messages': 0, 'replies_received': 0, 'reactions_received': 0, 'score': 0.0}
+        for season_id, discord_id in keys
+    ]
+    stmt = _insert(conn, users)
+    # A no-op update, so the existing row's id is returned as well
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['season_id', 'discord_id'], set_={'discord_id': stmt.excluded.discord_id}
+    ).returning(users.c.id, users.c.season_id, users.c.discord_id)
+    for batch in _batches(rows):
+        for user_id, season_id, discord_id in conn.execute(stmt, batch):
+            ids[(season_id, discord_id)] = user_id
+    return ids
+
+def insert_messages(conn: Connection, rows: List[Dict]) -> Set[int]:
+    """Insert message rows, skipping ones already stored; returns the IDs that were new."""
+    stmt = _insert(conn, messages).on_conflict_do_nothing(
+        index_elements=['discord_message_id']
+    ).returning(messages.c.discord_message_id)
+    new = set()
+    for batch in _batches(rows):
+        new.update(row[0] for row in conn.execute(stmt, batch))
+    return new
+
+def _counter_upsert(conn: Connection):
+    """Upsert that counts one message against its author.
+
+    The streak rules match the original read-modify-write code: a message the day
+    after the last one extends the streak, a longer gap restarts it, and a message
+    on the same day (or an earlier one) leaves it alone.
+    """
+    stmt = _insert(conn, users)
+    new, old = stmt.excluded, users.c
+    days = _day_diff(conn, new.last_active_date, old.last_active_date)
+    streak = func.coalesce(old.streak, 0)
+    best_streak = func.coalesce(old.best_streak, 0)
+    total = func.coalesce(old.total_messages, 0) + new.total_messages
+    return stmt.on_conflict_do_update(
+        index_elements=['season_id', 'discord_id'],
+        set_={
+            'total_messages': total,
+            'streak': case(
+                (old.last_active_date.is_(None), 1),
+                (days == 1, streak + 1),
+                (days > 1, 1),
+                else_=old.streak
+            ),
+            'best_streak': case(
+                (and_(old.last_active_date.isnot(None), days == 1, streak + 1 > best_streak), streak + 1),
+                else_=old.best_streak
+            ),
+            'last_active_date': new.last_active_date,
+            'first_active_date': case(
+                (or_(old.first_active_date.is_(None), new.first_active_date < old.first_active_date),
+                 new.first_active_date),
+                else_=old.first_active_date
+            ),
+            'night_owl_messages': func.coalesce(old.night_owl_messages, 0) + new.night_owl_messages,
+            'early_bird_messages': func.coalesce(old.early_bird_messages, 0) + new.early_bird_messages,
+            'weekend_messages': func.coalesce(old.weekend_messages, 0) + new.weekend_messages,
+            'weekday_messages': func.coalesce(old.weekday_messages, 0) + new.weekday_messages,
+            'score': engagement_score(total, func.coalesce(old.replies_received, 0),
+                                      func.coalesce(old.reactions_received, 0)),
+        }
+    ).returning(
+        users.c.id, users.c.total_messages, users.c.streak, users.c.night_owl_messages,
+        users.c.early_bird_messages, users.c.weekend_messages
+    )
+
+def count_messages(conn: Connection, authored: List[Tuple[int, int, datetime]]) -> List[Tuple]:
+    """Apply (season_id, discord_id, timestamp) messages, in order, to their authors' counters.
+
+    Streaks depend on message order, so each message is its own upsert row. Rows
+    are grouped into rounds holding at most one message per author, which lets a
+    round go out as one multi-row statement. Returns the counters after every
+    message, for badge checks.
+    """
+    rounds: List[List[Dict]] = []
+    seen: Dict[Tuple[int, int], int] = defaultdict(int)
+    for season_id, discord_id, timestamp in authored:
+        key = (season_id, discord_id)
+        if seen[key] == len(rounds):
+            rounds.append([])
+        hour, weekend = timestamp.hour, timestamp.weekday() >= 5
+        rounds[seen[key]].append({
+            'season_id': season_id, 'discord_id': discord_id, 'total_messages': 1, 'streak': 1,
+            'best_streak': 0, 'last_active_date': timestamp, 'first_active_date': timestamp,
+            'night_owl_messages': int(hour in NIGHT_OWL_HOURS),
+            'early_bird_messages': int(hour not in NIGHT_OWL_HOURS and hour in EARLY_BIRD_HOURS),
+            'weekend_messages': int(weekend), 'weekday_messages': int(not weekend),
+            'replies_received': 0, 'reactions_received': 0, 'score': SCORE_WEIGHT_MESSAGES,
+        })
+        seen[key] += 1
+
+    stmt = _counter_upsert(conn)
+    counters = []
+    for round_rows in rounds:
+        for batch in _batches(round_rows):
+            counters.extend(conn.execute(stmt, batch))
+    return counters
+
+def add_activity(conn: Connection, cells: Dict[Tuple[int, int, int], int]):
+    """Add message counts to (user_id, day_of_week, hour) activity cells."""
+    stmt = _insert(conn, activity_patterns)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'day_of_week', 'hour'],
+        set_={'message_count': activity_patterns.c.message_count + stmt.excluded.message_count}
+    )
+    rows = [
+        {'user_id': user_id, 'day_of_week': day_of_week, 'hour': hour, 'message_count': count}
+        for (user_id, day_of_week, hour), count in cells.items()
+    ]
+    for batch in _batches(rows):
+        conn.execute(stmt, batch)
+
+def _badge_definitions(conn: Connection) -> List[Tuple]:
+    global _badges
+    if _badges is None:
+        _badges = list(conn.execute(select(
+            Badge.id, Badge.name, Badge.requirement_type, Badge.requirement_value
+        )))
+    return _badges
+
+def earned_badges(conn: Connection, counters) -> List[int]:
+    """IDs of the badges a user qualifies for given their counters."""
+    _, total, streak, night_owl, early_bird, weekend = counters
+    earned = []
+    for badge_id, name, requirement_type, requirement_value in _badge_definitions(conn):
+        awarded = False
+        if requirement_type == 'percentage':
+            share = {'Night Owl': night_owl, 'Early Bird': early_bird, 'Weekend Warrior': weekend}.get(name)
+            if share is not None:
+                percentage = (share or 0) / total * 100 if total else 0
+                awarded = percentage >= requirement_value
+        elif requirement_type == 'streak':
+            awarded = (streak or 0) >= requirement_value
+        if awarded:
+            earned.append(badge_id)
+    return earned
+
+def award_badges(conn: Connection, pairs: Set[Tuple[int, int]]):
+    """Award (user_id, badge_id) pairs; badges a user already has are left alone."""
+    stmt = _insert(conn, user_badges).on_conflict_do_nothing(index_elements=['user_id', 'badge_id'])
+    now = datetime.utcnow()
+    rows = [{'user_id': user_id, 'badge_id': badge_id, 'earned_date': now} for user_id, badge_id in pairs]
+    for batch in _batches(rows):
+        conn.execute(stmt, batch)
+
+def ingest_messages(conn: Connection, records: List[Tuple]) -> List[Tuple[int, int, int, datetime]]:
+    """Store message records and update their authors' stats in the seasons they were sent in.
+
+    Records are (message_id, author_id, channel_id, timestamp[, reply_to_id]).
+    Messages that are already stored, or whose season is missing or archived, are
+    skipped. Every write is a set-based INSERT ... ON CONFLICT statement, so no row
+    is read before it is updated. Returns (message_id, user_id, season_id,
+    timestamp) for each new message, in record order.
+    """
+    candidates, seen = [], set()
+    for record in records:
+        message_id, author_id, channel_id, timestamp = record[:4]
+        reply_to_id = record[4] if len(record) > 4 else None
+        if message_id in seen:
+            continue
+        seen.add(message_id)
+        season = season_for(timestamp)
+        if season is None or season.archived_at is not None:
+            continue
+        # Stored timestamps are naive UTC
+        candidates.append((message_id, author_id, channel_id, timestamp.replace(tzinfo=None),
+                           reply_to_id, season.id))
+    if not candidates:
+        return []
+
+    user_ids = ensure_users(conn, {(season_id, author_id) for _, author_id, _, _, _, season_id in candidates})
+    new_ids = insert_messages(conn, [
+        {'discord_message_id': message_id, 'user_id': user_ids[(season_id, author_id)],
+         'channel_id': channel_id, 'timestamp': timestamp, 'reaction_count': 0, 'reply_count': 0,
+         'reply_to_id': reply_to_id}
+        for message_id, author_id, channel_id, timestamp, reply_to_id, season_id in candidates
+    ])
+    new = [candidate for candidate in candidates if candidate[0] in new_ids]
+    if not new:
+        return []
+
+    counters = count_messages(conn, [(season_id, author_id, timestamp)
+                                     for _, author_id, _, timestamp, _, season_id in new])
+    cells: Dict[Tuple[int, int, int], int] = defaultdict(int)
+    for _, author_id, _, timestamp, _, season_id in new:
+        cells[(user_ids[(season_id, author_id)], timestamp.weekday(), timestamp.hour)] += 1
+    add_activity(conn, cells)
+    award_badges(conn, {(row[0], badge_id) for row in counters for badge_id in earned_badges(conn, row)})
+
+    return [(message_id, user_ids[(season_id, author_id)], season_id, timestamp)
+            for message_id, author_id, _, timestamp, _, season_id in new]
+
+def remove_messages(conn: Connection, message_ids: Iterable[int]) -> Tuple[List[Tuple[int, int, datetime]], List[int]]:
+    """Delete stored messages and take their contribution back out of the rollups.
+
+    Message counts, the time-of-day and weekday/weekend splits, activity cells,
+    scores, and the replies and reactions the messages received are reversed with
+    one batched UPDATE per table. A deleted reply is also taken off its parent's
+    reply count and the parent author's replies received. Reactions the authors
+    gave are not stored per message, so they stay counted. Streaks, first/last activity
+    dates and badges are history-dependent and are left as they are. Ended
+    seasons' standings are final, so their messages stay stored and counted;
+    their IDs are ignored like unknown ones. Returns (user_id, season_id, timestamp) for each removed message,
+    and the ids of every user whose counters changed.
+    """
+    message_ids = list(set(message_ids))
+    current_users = select(users.c.id).where(users.c.season_id == current_season().id)
+    removed = []
+    for batch in _batches(message_ids):
+        removed.extend(conn.execute(
+            delete(messages).where(messages.c.discord_message_id.in_(batch),
+                                   messages.c.user_id.in_(current_users)).returning(
+                messages.c.user_id, messages.c.timestamp, messages.c.reply_to_id,
+                messages.c.reaction_count, messages.c.reply_count
+            )
+        ))
+    if not removed:
+        return [], []
+
+    authors: Dict[int, Tuple[int, int]] = {}
+    for batch in _batches(list({row[0] for row in removed})):
+        for user_id, discord_id, season_id in conn.execute(
+                select(users.c.id, users.c.discord_id, users.c.season_id).where(users.c.id.in_(batch))):
+            authors[user_id] = (discord_id, season_id)
+
+    # Parents that are still stored lose the reply, unless it was a self-reply or, like
+    # every engagement with ended seasons, was never counted
+    parents: Dict[int, Tuple[int, int]] = {}
+    parent_ids = list({row[2] for row in removed if row[2] is not None})
+    for batch in _batches(parent_ids):
+        for message_id, user_id, discord_id in conn.execute(
+                select(messages.c.discord_message_id, messages.c.user_id, users.c.discord_id)
+                .join(users, users.c.id == messages.c.user_id)
+                .where(messages.c.user_id.in_(current_users), messages.c.discord_message_id.in_(batch))):
+            parents[message_id] = (user_id, discord_id)
+
+    deltas: Dict[int, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    cells: Dict[Tuple[int, int, int], int] = defaultdict(int)
+    parent_replies: Dict[int, int] = defaultdict(int)
+    for user_id, timestamp, reply_to_id, reaction_count, reply_count in removed:
+        delta = deltas[user_id]
+        delta['messages'] += 1
+        delta['replies'] += reply_count or 0
+        delta['reactions'] += reaction_count or 0
+        if timestamp is not None:
+            hour, weekend = timestamp.hour, timestamp.weekday() >= 5
+            delta['night_owl'] += int(hour in NIGHT_OWL_HOURS)
+            delta['early_bird'] += int(hour not in NIGHT_OWL_HOURS and hour in EARLY_BIRD_HOURS)
+            delta['weekend'] += int(weekend)
+            delta['weekday'] += int(not weekend)
+            cells[(user_id, timestamp.weekday(), hour)] += 1
+        parent = parents.get(reply_to_id)
+        if parent and parent[1] != authors.get(user_id, (None,))[0]:
+            parent_replies[reply_to_id] += 1
+            deltas[parent[0]]['replies'] += 1
+
+    if parent_replies:
+        conn.execute(
+            update(messages).where(messages.c.discord_message_id == bindparam('b_message_id'))
+            .values(reply_count=messages.c.reply_count - bindparam('b_replies')),
+            [{'b_message_id': message_id, 'b_replies': count} for message_id, count in parent_replies.items()]
+        )
+
+    remaining = {
+        'total_messages': users.c.total_messages - bindparam('b_messages'),
+        'replies_received': users.c.replies_received - bindparam('b_replies'),
+        'reactions_received': users.c.reactions_received - bindparam('b_reactions'),
+    }
+    conn.execute(
+        update(users).where(users.c.id == bindparam('b_user_id')).values(
+            night_owl_messages=users.c.night_owl_messages - bindparam('b_night_owl'),
+            early_bird_messages=users.c.early_bird_messages - bindparam('b_early_bird'),
+            weekend_messages=users.c.weekend_messages - bindparam('b_weekend'),
+            weekday_messages=users.c.weekday_messages - bindparam('b_weekday'),
+            score=engagement_score(*remaining.values()),
+            **remaining
+        ),
+        [
+            {'b_user_id': user_id,
+             **{f'b_{name}': delta[name] for name in
+                ('messages', 'replies', 'reactions', 'night_owl', 'early_bird', 'weekend', 'weekday')}}
+            for user_id, delta in deltas.items()
+        ]
+    )
+
+    if cells:
+        conn.execute(
+            update(activity_patterns).where(and_(
+                activity_patterns.c.user_id == bindparam('b_user_id'),
+                activity_patterns.c.day_of_week == bindparam('b_day_of_week'),
+                activity_patterns.c.hour == bindparam('b_hour'),
+            )).values(message_count=activity_patterns.c.message_count - bindparam('b_count')),
+            [{'b_user_id': user_id, 'b_day_of_week': day_of_week, 'b_hour': hour, 'b_count': count}
+             for (user_id, day_of_week, hour), count in cells.items()]
+        )
+
+    return ([(user_id, authors[user_id][1], timestamp) for user_id, timestamp, _, _, _ in removed
+             if user_id in authors], list(deltas))
+
+def stored_channel_ids(conn: Connection) -> Set[int]:
+    """Channels that have stored current-season messages."""
+    current_users = select(users.c.id).where(users.c.season_id == current_season().id)
+    return {row[0] for row in conn.execute(
+        select(messages.c.channel_id).where(messages.c.user_id.in_(current_users)).distinct()
+    )}
+
+def channel_message_ids(conn: Connection, channel_ids: Iterable[int], limit: int) -> List[int]:
+    """Up to ``limit`` stored current-season message IDs from the given channels."""
+    current_users = select(users.c.id).where(users.c.season_id == current_season().id)
+    return [row[0] for row in conn.execute(
+        select(messages.c.discord_message_id)
+        .where(messages.c.channel_id.in_(list(channel_ids)), messages.c.user_id.in_(current_users))
+        .limit(limit)
+    )]
+
+def channel_cursor(conn: Connection, channel_id: int) -> Optional[int]:
+    """Newest message ID the history backfill has read in a channel, if any."""
+    return conn.execute(
+        select(channel_cursors.c.last_message_id).where(channel_cursors.c.channel_id == channel_id)
+    ).scalar()
+
+def advance_channel_cursor(conn: Connection, channel_id: int, message_id: int):
+    """Move a channel's backfill cursor forward; it never moves back."""
+    stmt = _insert(conn, channel_cursors).values(channel_id=channel_id, last_message_id=message_id)
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=['channel_id'],
+        set_={'last_message_id': case(
+            (stmt.excluded.last_message_id > channel_cursors.c.last_message_id, stmt.excluded.last_message_id),
+            else_=channel_cursors.c.last_message_id
+        )}
+    ))
+
+def clear_channel_cursors(conn: Connection, channel_ids: Iterable[int]):
+    """Forget backfill progress, so channels that are tracked again are fetched in full."""
+    conn.execute(delete(channel_cursors).where(channel_cursors.c.channel_id.in_(list(channel_ids))))